@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+# -----------------------------------------------------------------------------
+# Distributed Systems (TDDD25)
+# -----------------------------------------------------------------------------
+# Author: Sergiu Rafiliu (sergiu.rafiliu@liu.se)
+# Modified: 31 July 2013
+#
+# Copyright 2012 Linkoping University
+# -----------------------------------------------------------------------------
+
+"""Benchmark of the transports of the Object Request Broker.
+
+For every transport, a skeleton is started in a process of its own and
+a stub of this process calls it, first one call at a time (latency) and
+then with many calls in flight at once (throughput), for every payload
+size. The loopback transport runs the skeleton in this very process.
+
+"""
+
+import sys
+import time
+import argparse
+import multiprocessing
+
+sys.path.append("../modules")
+from Common import orb
+from Common import transport
+
+# -----------------------------------------------------------------------------
+# Initialize and read the command line arguments
+# -----------------------------------------------------------------------------
+
+TRANSPORTS = {
+    "tcp": [transport.TCP],
+    "unix": [transport.UNIX, transport.TCP],
+    "loopback": []
+}
+
+description = """\
+Compare the latency and throughput of the transports of the broker.\
+"""
+parser = argparse.ArgumentParser(description=description)
+parser.add_argument(
+    "-n", "--calls", metavar="CALLS", dest="calls", type=int, default=2000,
+    help="Set the number of calls of every measurement. Default: 2000."
+)
+parser.add_argument(
+    "-s", "--sizes", metavar="SIZE", dest="sizes", type=int, nargs="+",
+    default=[16, 4096, 65536],
+    help="Set the payload sizes in bytes. Default: 16 4096 65536."
+)
+parser.add_argument(
+    "-w", "--window", metavar="CALLS", dest="window", type=int, default=64,
+    help="Set the number of calls in flight when measuring throughput."
+)
+parser.add_argument(
+    "-t", "--transports", metavar="NAME", dest="transports", nargs="+",
+    default=sorted(TRANSPORTS), choices=sorted(TRANSPORTS),
+    help="Set the transports to compare. Default: all of them."
+)
+
+# -----------------------------------------------------------------------------
+# Auxiliary classes
+# -----------------------------------------------------------------------------
+
+
+class Echo(object):
+    """The remote object called by the benchmark."""
+
+    def echo(self, payload):
+        return payload
+
+
+def serve(transports, pipe, stop):
+    """Run a skeleton in a process of its own until stop is set.
+
+    The skeleton listens to a free port, whose address is sent through
+    pipe once it is ready.
+
+    """
+
+    transport.transports[:] = transports
+    skeleton = orb.Skeleton(Echo(), ("127.0.0.1", 0))
+    skeleton.start()
+    pipe.send(skeleton.address)
+    stop.wait()
+
+
+def latency(stub, payload, calls):
+    """Return the mean time of a call, made one at a time."""
+
+    start = time.perf_counter()
+    for i in range(calls):
+        stub.echo(payload)
+    return (time.perf_counter() - start) / calls
+
+
+def throughput(stub, payload, calls, window):
+    """Return the calls per second, with window calls in flight."""
+
+    start = time.perf_counter()
+    done = 0
+    while done < calls:
+        futures = [stub.echo.future(payload)
+                   for i in range(min(window, calls - done))]
+        for future in futures:
+            future.result()
+        done += len(futures)
+    return calls / (time.perf_counter() - start)
+
+
+# -----------------------------------------------------------------------------
+# The main program
+# -----------------------------------------------------------------------------
+
+if __name__ == "__main__":
+    opts = parser.parse_args()
+    print("{:<9} {:>8} {:>12} {:>12}".format(
+        "transport", "size", "latency(us)", "calls/s"))
+    for name in opts.transports:
+        transport.transports[:] = TRANSPORTS[name]
+        stop = multiprocessing.Event()
+        if name == "loopback":
+            skeleton = orb.Skeleton(Echo(), ("127.0.0.1", 0))
+            skeleton.start()
+            address = skeleton.address
+        else:
+            receiver, sender = multiprocessing.Pipe(False)
+            server = multiprocessing.Process(
+                target=serve, args=(TRANSPORTS[name], sender, stop))
+            server.start()
+            address = receiver.recv()
+        stub = orb.Stub(address)
+        for size in opts.sizes:
+            payload = "x" * size
+            stub.echo(payload)
+            mean = latency(stub, payload, opts.calls)
+            rate = throughput(stub, payload, opts.calls, opts.window)
+            print("{:<9} {:>8} {:>12.1f} {:>12.0f}".format(
+                name, size, mean * 1e6, rate))
+        stop.set()
+        if name != "loopback":
+            server.join()
@@ -16,6 +16,9 @@ import socket
 import json
 import argparse
 
+sys.path.append("../modules")
+from Common import framing
+
 # -----------------------------------------------------------------------------
 # Initialize and read the command line arguments
 # -----------------------------------------------------------------------------
@@ -70,11 +73,14 @@ class DatabaseProxy(object):
 
     def send(self, message):
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.socket.connect(self.address)
-        message = message + "\n"
-        self.socket.send(message.encode())
-        result = self.socket.recv(1024)
-        self.socket.close()
+        try:
+            self.socket.connect(self.address)
+            framing.send_frame(self.socket, message.encode())
+            result, flags = framing.Reader(self.socket).read_frame()
+        finally:
+            self.socket.close()
+        if result is None:
+            raise ComunicationError("Connection closed by the server", [])
         return result
 
     # Public methods
@@ -85,7 +91,7 @@ class DatabaseProxy(object):
         message = json.dumps({"method":"read","args":[]})
         result = self.send(message)
         try:
-            output = json.loads(result.decode())
+            output = json.loads(str(result, "utf-8"))
             if("result" in output):
                 return output["result"]
             elif("error" in output):
@@ -112,7 +118,7 @@ class DatabaseProxy(object):
         message = json.dumps({"method":"write","args":[fortune]})
         result = self.send(message)
         try:
-            output = json.loads(result.decode())
+            output = json.loads(str(result, "utf-8"))
             if("result" in output and output["result"] == "NULL"):
                 return
             elif("error" in output):
@@ -126,6 +132,29 @@ class DatabaseProxy(object):
         finally:
             pass
 
+    def _call(self, method, args):
+        """Call method on the server and return its result."""
+
+        result = self.send(json.dumps({"method": method, "args": args}))
+        output = json.loads(str(result, "utf-8"))
+        if "error" in output:
+            exception = type(output["error"]["name"], (Exception,), {})
+            raise exception(output["error"]["args"])
+        if "result" not in output:
+            raise ComunicationError("Unknown communication protocol exception",
+                                    ["Not following communication protocol"])
+        return output["result"]
+
+    def read_many(self, n):
+        """Read n fortunes with a single request."""
+
+        return self._call("read_many", [n])
+
+    def write_many(self, fortunes):
+        """Write fortunes with a single request."""
+
+        self._call("write_many", [list(fortunes)])
+
 # -----------------------------------------------------------------------------
 # The main program
 # -----------------------------------------------------------------------------
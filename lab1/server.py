@@ -16,10 +16,13 @@ import socket
 import json
 import random
 import argparse
+import multiprocessing
 
 import sys
 sys.path.append("../modules")
+from Common import framing
 from Server.database import Database
+from Server import writeLog
 from Server.Lock.readWriteLock import ReadWriteLock
 
 # -----------------------------------------------------------------------------
@@ -43,7 +46,22 @@ parser.add_argument(
     "-f", "--file", metavar="FILE", dest="file", default="dbs/fortune.db",
     help="Set the database file. Default: dbs/fortune.db."
 )
+parser.add_argument(
+    "-n", "--processes", metavar="COUNT", dest="processes", type=int,
+    default=1,
+    help="Set the number of processes serving the clients. Default: 1."
+)
+parser.add_argument(
+    "-s", "--storage", metavar="STORAGE", dest="storage", default="mmap",
+    choices=["list", "compact", "mmap"],
+    help="Set how the fortunes are kept: list, all in memory as strings, "
+         "compact, all in memory in a single buffer, or mmap, mapped from "
+         "the file with their offsets kept in FILE.idx. The last two only "
+         "decode the fortunes that are read. Default: mmap."
+)
 opts = parser.parse_args()
+if opts.processes > 1 and not hasattr(socket, "SO_REUSEPORT"):
+    parser.error("more than one process needs SO_REUSEPORT")
 
 db_file = opts.file
 server_address = ("", opts.port)
@@ -54,11 +72,31 @@ server_address = ("", opts.port)
 
 
 class Server(object):
-    """Class that provides synchronous access to the database."""
+    """Class that provides synchronous access to the database.
+
+    In a worker process, writer_conn is the connection to the writer
+    process, which writes the fortunes on behalf of all the workers.
 
-    def __init__(self, db_file):
-        self.db = Database(db_file)
+    """
+
+    def __init__(self, db, writer_conn=None):
+        self.db = db
         self.rwlock = ReadWriteLock()
+        self.writer = None
+        if writer_conn is not None:
+            self.writer = WriterProxy(writer_conn, self._add)
+
+    # Private methods
+
+    def _add(self, fortunes):
+        """Add fortunes written by the writer process."""
+
+        self.rwlock.write_acquire()
+        try:
+            for fortune in fortunes:
+                self.db.add(fortune)
+        finally:
+            self.rwlock.write_release()
 
     # Public methods
     def read(self):
@@ -77,22 +115,211 @@ class Server(object):
             self.rwlock.read_release()
         return result
 
-    def write(self, fortune):
+    def read_many(self, n):
+        """Read n fortunes, taking the read lock once."""
+
+        self.rwlock.read_acquire()
+        try:
+            return self.db.read_many(n)
+        finally:
+            self.rwlock.read_release()
+
+    def write(self, fortune, durability=writeLog.OS):
         #
         # Your code here
         #
-        
-        # Acquire the lock when writing, in order for no
-        # reading or writing from other threads to perform
-        # any operations during this write. Lock is released 
-        # afterwards, and default value "NULL" is returned to
-        # indicate that everything went as it should.
-        self.rwlock.write_acquire()
+
+        # The database orders the writes itself, in its log, and writes
+        # the ones made at the same time together, so the write lock is
+        # not taken here: it would only make them wait for each other.
+        # Default value "NULL" is returned to indicate that everything
+        # went as it should.
+        if self.writer is not None:
+            # The fortune comes back through _add once it is written.
+            self.writer.write([fortune], durability)
+            return "NULL"
+        self.db.write(fortune, durability)
+        return "NULL"
+
+    def write_many(self, fortunes, durability=writeLog.OS):
+        """Write fortunes, appending them to the file at once."""
+
+        if self.writer is not None:
+            self.writer.write(fortunes, durability)
+            return "NULL"
+        self.db.write_many(fortunes, durability)
+        return "NULL"
+
+
+class WriterProxy(object):
+    """The writer process, as seen from a worker process.
+
+    Writes are sent to the writer, which sends every fortune written,
+    by any worker, back to all of them. A write returns once the worker
+    has added its fortune, so the clients of a worker read their own
+    writes, unless its durability is writeLog.NONE.
+
+    A write raises the error the writer met writing its fortunes. The
+    error of a write made with writeLog.NONE is raised by the next one.
+
+    """
+
+    def __init__(self, conn, add):
+        self.conn = conn
+        self.add = add
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        self.next_id = 0
+        self.waiting = {}
+        self.errors = {}
+        # The error of a write nobody waited for, not raised yet.
+        self.error = None
+        self.failed = False
+        thread = threading.Thread(target=self._receive)
+        thread.daemon = True
+        thread.start()
+
+    def _finish(self, kind, call_id, error=None):
+        """Wake up the write the writer is done with."""
+
+        self.lock.acquire()
         try:
-            self.db.write(fortune)
+            done = self.waiting.pop(call_id, None)
+            if error is not None:
+                if done is None:
+                    self.error = self.error or error
+                else:
+                    self.errors[call_id] = error
         finally:
-            self.rwlock.write_release()
-        return "NULL"
+            self.lock.release()
+        if done is not None:
+            done.set()
+
+    def _receive(self):
+        try:
+            while True:
+                message = self.conn.recv()
+                if message[0] == "fortunes":
+                    self.add(message[1])
+                else:
+                    self._finish(*message)
+        except (EOFError, OSError):
+            pass
+        finally:
+            self.lock.acquire()
+            try:
+                self.failed = True
+                for done in self.waiting.values():
+                    done.set()
+            finally:
+                self.lock.release()
+
+    def write(self, fortunes, durability=writeLog.OS):
+        """Have the writer write fortunes, and add them here.
+
+        Wait until they are added, unless durability is writeLog.NONE;
+        an error of the writer is then raised by the next write.
+
+        """
+
+        if durability not in writeLog.DURABILITIES:
+            raise ValueError("Unknown durability: {}".format(durability))
+        done = threading.Event()
+        self.lock.acquire()
+        try:
+            if self.failed:
+                raise RuntimeError("The writer process is gone")
+            if self.error is not None:
+                error, self.error = self.error, None
+                raise error
+            self.next_id += 1
+            call_id = self.next_id
+            if durability != writeLog.NONE:
+                self.waiting[call_id] = done
+        finally:
+            self.lock.release()
+        # Not under self.lock, which the replies of the writer need: the
+        # writer may be busy sending them to us and not reading.
+        self.send_lock.acquire()
+        try:
+            self.conn.send(("write", call_id, fortunes, durability))
+        finally:
+            self.send_lock.release()
+        if durability == writeLog.NONE:
+            return
+        done.wait()
+        self.lock.acquire()
+        try:
+            error = self.errors.pop(call_id, None)
+        finally:
+            self.lock.release()
+        if error is not None:
+            raise error
+        if self.failed:
+            raise RuntimeError("The writer process is gone")
+
+
+class Writer(object):
+    """Writes the fortunes sent by the worker processes.
+
+    Every fortune is appended to the file, and then sent to all the
+    workers, before the worker that sent it is told it is done. The
+    fortunes of different workers are written to the file together by
+    the log of the database.
+
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.lock = threading.Lock()
+        self.conns = []
+
+    def _reply(self, conn, reply):
+        try:
+            conn.send(reply)
+        except OSError:
+            # The worker is gone, which its next recv tells.
+            pass
+        except Exception:
+            # The error could not be pickled.
+            conn.send(reply[:2] + (RuntimeError(repr(reply[2])),))
+
+    def _serve(self, conn):
+        while True:
+            try:
+                kind, call_id, fortunes, durability = conn.recv()
+            except (EOFError, OSError):
+                # The worker is gone.
+                return
+            # The workers read the fortunes from the file, so they must
+            # be in it before they are sent them.
+            if durability == writeLog.NONE:
+                durability = writeLog.OS
+            try:
+                self.db.write_many(fortunes, durability)
+            except Exception as e:
+                self._reply(conn, ("error", call_id, e))
+                continue
+            self.lock.acquire()
+            try:
+                for other in self.conns:
+                    try:
+                        other.send(("fortunes", fortunes))
+                    except OSError:
+                        # That worker is gone.
+                        pass
+                self._reply(conn, ("done", call_id))
+            finally:
+                self.lock.release()
+
+    def add(self, conn):
+        self.conns.append(conn)
+
+    def start(self):
+        for conn in self.conns:
+            thread = threading.Thread(target=self._serve, args=(conn,))
+            thread.daemon = True
+            thread.start()
 
 
 class Request(threading.Thread):
@@ -153,6 +380,10 @@ class Request(threading.Thread):
         # Pack exceptiosn extracting name and arguments of eception thrown
         try :
             message = json.loads(request)
+            if message["method"].startswith("_"):
+                # Private methods cannot be called by the clients.
+                raise AttributeError(
+                    "No remote method {}".format(message["method"]))
             fn = getattr(self.db_server, message["method"])
             result = json.dumps({"result" : fn(*message["args"])})
 
@@ -188,15 +419,17 @@ class Request(threading.Thread):
 
     def run(self):
         try:
-            # Threat the socket as a file stream.
-            worker = self.conn.makefile(mode="rw")
-            # Read the request in a serialized form (JSON).
-            request = worker.readline()
-            # Process the request.
-            result = self.process_request(request)
-            # Send the result.
-            worker.write(result + '\n')
-            worker.flush()
+            reader = framing.Reader(self.conn)
+            # Serve requests until the client closes the connection.
+            while True:
+                # Read the request in a serialized form (JSON).
+                request, flags = reader.read_frame()
+                if request is None:
+                    break
+                # Process the request.
+                result = self.process_request(str(request, "utf-8"))
+                # Send the result.
+                framing.send_frame(self.conn, result.encode())
         except Exception as e:
             # Catch all errors in order to prevent the object from crashing
             # due to bad connections coming from outside.
@@ -205,6 +438,38 @@ class Request(threading.Thread):
         finally:
             self.conn.close()
 
+
+def listen(reuse_port=False):
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if reuse_port:
+        # The workers listen to the same port, and the kernel spreads
+        # the clients among them.
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    server.bind(server_address)
+    server.listen(1)
+    return server
+
+
+def serve(sync_db, server):
+    try:
+        while True:
+            try:
+                conn, addr = server.accept()
+                req = Request(sync_db, conn, addr)
+                print("Serving a request from {0}".format(addr))
+                req.start()
+            except socket.error:
+                continue
+    except KeyboardInterrupt:
+        pass
+
+
+def serve_worker(db, writer_conn):
+    """Serve clients in a worker process."""
+
+    serve(Server(db, writer_conn), listen(reuse_port=True))
+
+
 # -----------------------------------------------------------------------------
 # The main program
 # -----------------------------------------------------------------------------
@@ -213,22 +478,30 @@ print("Listening to: {}:{}".format(socket.gethostname(), opts.port))
 with open("srv_address.tmp", "w") as f:
     f.write("{}:{}\n".format(socket.gethostname(), opts.port))
 
-sync_db = Server(db_file)
 
-server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-server.bind(server_address)
-server.listen(1)
+# The database is read before forking, so the workers start with the
+# pages holding it shared with the writer.
+db = Database(db_file, opts.storage)
 
 print("Press Ctrl-C to stop the server...")
 
-try:
-    while True:
-        try:
-            conn, addr = server.accept()
-            req = Request(sync_db, conn, addr)
-            print("Serving a request from {0}".format(addr))
-            req.start()
-        except socket.error:
-            continue
-except KeyboardInterrupt:
-    pass
+if opts.processes == 1:
+    serve(Server(db), listen())
+else:
+    context = multiprocessing.get_context("fork")
+    writer = Writer(db)
+    workers = []
+    for i in range(opts.processes):
+        writer_conn, worker_conn = context.Pipe()
+        worker = context.Process(target=serve_worker, args=(db, worker_conn))
+        worker.start()
+        worker_conn.close()
+        writer.add(writer_conn)
+        workers.append(worker)
+    writer.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.join()
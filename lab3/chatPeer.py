@@ -90,7 +90,7 @@ class Client(orb.Peer):
 
     def send_message(self, to_id, msg):
         try:
-            self.peer_list.peer(to_id).print_message(self.id, msg)
+            self.peer_list.peer(to_id).print_message.oneway(self.id, msg)
         except Exception:
             print(("Cannot send messages to {}."
                   "Make sure it is in the list of peers.").format(to_id))
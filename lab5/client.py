@@ -32,6 +32,10 @@ parser.add_argument(
     "-w", "--write", metavar="FORTUNE", dest="fortune",
     help="Write a new fortune to the database."
 )
+parser.add_argument(
+    "-n", "--count", metavar="COUNT", dest="count", type=int, default=1,
+    help="Read COUNT fortunes, all of them in a single request."
+)
 parser.add_argument(
     "-i", "--interactive", action="store_true", dest="interactive",
     default=False, help="Interactive session with the fortune database."
@@ -71,7 +75,15 @@ if not opts.interactive:
     # Run in the normal mode.
     if opts.fortune is not None:
         print("Writing '{}' to the fortune database.".format(opts.fortune))
-        db.write(opts.fortune)
+        skipped = db.write(opts.fortune)
+        if skipped:
+            print("The replicas {} missed the write.".format(skipped))
+    elif opts.count > 1:
+        with orb.Batch(db) as batch:
+            for i in range(opts.count):
+                batch.read()
+        for fortune in batch.results:
+            print(fortune)
     else:
         print(db.read())
 
@@ -95,6 +107,8 @@ Choose one of the following commands:
             print(db.read())
         elif (len(command) > 1 and command[0] == "w" and
                 command[1] in [" ", "\t"]):
-            db.write(command[2:].strip())
+            skipped = db.write(command[2:].strip())
+            if skipped:
+                print("The replicas {} missed the write.".format(skipped))
         elif command == "h":
             menu()
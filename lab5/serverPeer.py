@@ -28,6 +28,7 @@ from Common.nameServiceLocation import name_service_address
 from Common.objectType import object_type
 
 from Server import database
+from Server import writeLog
 from Server.peerList import PeerList
 from Server.Lock.distributedLock import DistributedLock
 from Server.Lock.distributedReadWriteLock import DistributedReadWriteLock
@@ -54,10 +55,19 @@ parser.add_argument(
     "-f", "--file", metavar="FILE", dest="file", default="dbs/fortune.db",
     help="Set the database file. Default: dbs/fortune.db."
 )
+parser.add_argument(
+    "-s", "--storage", metavar="STORAGE", dest="storage", default="mmap",
+    choices=["list", "compact", "mmap"],
+    help="Set how the fortunes are kept: list, all in memory as strings, "
+         "compact, all in memory in a single buffer, or mmap, mapped from "
+         "the file with their offsets kept in FILE.idx. The last two only "
+         "decode the fortunes that are read. Default: mmap."
+)
 opts = parser.parse_args()
 
 local_port = opts.port
 db_file = opts.file
+storage = opts.storage
 server_type = opts.type
 assert server_type != "object", "Change the object type to something unique!"
 
@@ -70,14 +80,15 @@ assert server_type != "object", "Change the object type to something unique!"
 class Server(orb.Peer):
     """Distributed mutual exclusion client class."""
 
-    def __init__(self, local_address, ns_address, server_type, db_file):
+    def __init__(self, local_address, ns_address, server_type, db_file,
+                 storage="list"):
         """Initialize the client."""
 
         orb.Peer.__init__(self, local_address, ns_address, server_type)
         self.peer_list = PeerList(self)
         self.distributed_lock = DistributedLock(self, self.peer_list)
         self.drwlock = DistributedReadWriteLock(self.distributed_lock)
-        self.db = database.Database(db_file)
+        self.db = database.Database(db_file, storage)
         self.dispatched_calls = {
             "display_peers":      self.peer_list.display_peers,
             "acquire":            self.distributed_lock.acquire,
@@ -90,6 +101,30 @@ class Server(orb.Peer):
         self.peer_list.initialize()
         self.distributed_lock.initialize()
 
+    # Private methods
+
+    def _replicate(self, method, *args):
+        """Call method on every replica at once.
+
+        Return the ids of the replicas that were skipped, because they
+        look dead or could not be reached, and which therefore miss the
+        write.
+
+        """
+
+        available = self.peer_list.available()
+        skipped = [pid for pid in list(self.peer_list.get_peers())
+                   if pid not in available]
+        results, errors = self.peer_list.gather(method, *args,
+                                                pids=available)
+        for pid, error in errors.items():
+            if not orb.peer_failed(error):
+                raise error
+            skipped.append(pid)
+        if skipped:
+            print("The replicas {} missed the write.".format(sorted(skipped)))
+        return sorted(skipped)
+
     # Public methods
 
     def destroy(self):
@@ -121,34 +156,61 @@ class Server(orb.Peer):
             self.drwlock.read_release()
         return read
 
-    def write(self, fortune):
+    def read_many(self, n):
+        """Read n fortunes from the database, taking the lock once."""
+
+        self.drwlock.read_acquire()
+        try:
+            return self.db.read_many(n)
+        finally:
+            self.drwlock.read_release()
+
+    @orb.blocking
+    def write(self, fortune, durability=writeLog.OS):
         """Write a fortune to the database.
 
         Obtain the distributed lock and call all other servers to write
         the fortune as well. Call their 'write_no_lock' as they cannot
         atempt to obtain the distributed lock when writting their
-        copies.
+        copies. Return the ids of the replicas that missed the write.
 
         """
         #
         # Your code here.
         #
         
-        peers = self.peer_list.get_peers()
         self.drwlock.write_acquire()
         try:
             # self.peer_list.lock.acquire()
             print("Wrote:\n" + fortune)
-            self.db.write(fortune)
-            for peer in peers.values(): 
-                # if (not (pid == self.id)):
-                peer.write_no_lock(fortune)
+            self.db.write(fortune, durability)
+            # Send the fortune to all the replicas at once, skipping the
+            # ones that are dead.
+            return self._replicate("write_no_lock", fortune, durability)
         finally:
             # self.peer_list.lock.acquire()
             self.drwlock.write_release()
         
 
-    def write_no_lock(self, fortune):
+    @orb.blocking
+    def write_many(self, fortunes, durability=writeLog.OS):
+        """Write fortunes to the database.
+
+        The distributed lock is obtained once for all of them, and they
+        are sent to every other server in a single call. Return the ids
+        of the replicas that missed the write.
+
+        """
+
+        self.drwlock.write_acquire()
+        try:
+            self.db.write_many(fortunes, durability)
+            return self._replicate("write_many_no_lock", fortunes,
+                                   durability)
+        finally:
+            self.drwlock.write_release()
+
+    def write_no_lock(self, fortune, durability=writeLog.OS):
         """Write a fortune to the database.
 
         This method is called only by other servers onces they've
@@ -156,9 +218,24 @@ class Server(orb.Peer):
 
         """
 
-        self.db.write(fortune)
+        self.db.write(fortune, durability)
         print("Wrote with no lock:\n" + fortune)
 
+    def write_many_no_lock(self, fortunes, durability=writeLog.OS):
+        """Write fortunes sent by the server holding the distributed lock."""
+
+        self.db.write_many(fortunes, durability)
+
+    def stream(self, start=0, stop=None):
+        """Stream the fortunes of the database from start up to stop.
+
+        Lets a new replica copy the database of this one without having
+        it sent as a single message.
+
+        """
+
+        return self.db.stream(start, stop)
+
     def register_peer(self, pid, paddr):
         """Register a server peer in this server's peer list."""
 
@@ -177,7 +254,7 @@ class Server(orb.Peer):
 
 # Initialize the client object.
 local_address = (socket.gethostname(), local_port)
-p = Server(local_address, name_service_address, server_type, db_file)
+p = Server(local_address, name_service_address, server_type, db_file, storage)
 
 
 def menu():
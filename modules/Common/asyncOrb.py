@@ -0,0 +1,470 @@
+# -----------------------------------------------------------------------------
+# Distributed Systems (TDDD25)
+# -----------------------------------------------------------------------------
+# Author: Sergiu Rafiliu (sergiu.rafiliu@liu.se)
+# Modified: 31 July 2013
+#
+# Copyright 2012 Linkoping University
+# -----------------------------------------------------------------------------
+
+"""asyncio runtime for the Object Request Broker.
+
+The AsyncSkeleton speaks the same protocol, over the same transports,
+as orb.Skeleton, but serves all of its connections from a single event
+loop instead of starting a thread for each of them. Methods of the
+owner that are coroutines run on the loop itself, all the others run in
+a pool of worker threads.
+
+A peer uses it when created with runtime="asyncio" or when the
+ORB_RUNTIME environment variable is set to "asyncio".
+
+On the client side, AsyncStub is the counterpart of orb.Stub whose
+calls return awaitables, and gather calls a method on many stubs at
+once. Both honour the timeouts of the stubs and orb.deadline, and
+cancelling an awaited call cancels it on the server as well.
+
+"""
+
+import asyncio
+import concurrent.futures
+import contextvars
+import socket
+import threading
+import time
+
+from . import codec
+from . import compression
+from . import framing
+from . import metrics
+from . import orb
+from . import tracing
+from . import transport
+
+# Longest line accepted from clients of the line protocol.
+LINE_LIMIT = 1 << 26
+
+
+def _call_method(fn, message):
+    """Call fn with the arguments of a request and return the reply."""
+
+    return orb.result_reply(message, fn(*message["args"]))
+
+
+def _close(items):
+    try:
+        items.close()
+    except ValueError:
+        # Still running in another worker; it is closed once collected.
+        pass
+
+
+class _StreamCredit(object):
+    """The number of elements of a stream that the client is ready for."""
+
+    def __init__(self, window):
+        self.available = window
+        self.granted = asyncio.Event()
+
+    def grant(self, count):
+        self.available += count
+        self.granted.set()
+
+    async def take(self, expires):
+        """Wait until one more element may be sent, like orb.StreamCredit."""
+
+        while self.available <= 0:
+            self.granted.clear()
+            timeout = orb.STREAM_IDLE_TIMEOUT
+            if expires is not None:
+                timeout = min(timeout, orb.time_left(expires))
+            try:
+                await asyncio.wait_for(self.granted.wait(), timeout)
+            except asyncio.TimeoutError:
+                raise orb.DeadlineExceeded(
+                    "The client did not ask for more of the stream")
+        if expires is not None and orb.time_left(expires) <= 0:
+            raise orb.DeadlineExceeded("The stream did not complete in time")
+        self.available -= 1
+
+
+class AsyncStub(object):
+    """Stub whose remote calls return awaitables.
+
+    Calls share the connection of the orb.Stub of the same address, so
+    any number of them can be awaited at the same time.
+
+    """
+
+    def __init__(self, address, timeout=None):
+        self.address = tuple(address)
+        self.stub = orb.Stub(self.address, timeout)
+
+    def __getattr__(self, attr):
+        """Forward call to name over the network at the given address."""
+        async def rmi_call(*args):
+            expires = orb.expiry(self.stub.timeout)
+            return await _wait(self.stub._rmi_async(attr, *args), expires)
+        return rmi_call
+
+
+async def _wait(future, expires):
+    """Await the result of a call, cancelling it if expires passes first."""
+
+    wrapped = asyncio.wrap_future(future)
+    try:
+        done, pending = await asyncio.wait([wrapped],
+                                           timeout=orb.time_left(expires))
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    if not done:
+        # Not cancelled by asyncio.wait_for, which the breaker of the
+        # peer would not tell from a call cancelled by its caller.
+        orb.expire(future)
+        raise orb.DeadlineExceeded("The call did not complete in time")
+    return wrapped.result()
+
+
+async def gather(stubs, method, *args):
+    """Await method on all the stubs at the same time.
+
+    stubs is a dictionary of orb.Stub or AsyncStub objects. Return a
+    (results, errors) pair of dictionaries, as orb.gather does.
+
+    """
+
+    keys = []
+    calls = []
+    errors = {}
+    for key, stub in stubs.items():
+        if isinstance(stub, AsyncStub):
+            stub = stub.stub
+        try:
+            expires = orb.expiry(stub.timeout)
+            calls.append(_wait(stub._rmi_async(method, *args), expires))
+            keys.append(key)
+        except Exception as e:
+            errors[key] = e
+    results = {}
+    outcomes = await asyncio.gather(*calls, return_exceptions=True)
+    for key, outcome in zip(keys, outcomes):
+        if isinstance(outcome, Exception):
+            errors[key] = outcome
+        else:
+            results[key] = outcome
+    return results, errors
+
+
+class AsyncSkeleton(threading.Thread):
+    """Skeleton running an asyncio event loop in a thread of its own.
+
+    It takes the same options as orb.Skeleton, but for stream_workers:
+    its streams wait for their callers on the event loop, without
+    holding a thread.
+
+    """
+
+    def __init__(self, owner, address, workers=orb.WORKERS,
+                 queue_size=orb.QUEUE_SIZE, backlog=orb.BACKLOG,
+                 reuse_port=False, blocking_workers=orb.BLOCKING_WORKERS):
+        threading.Thread.__init__(self)
+        self.address = address
+        self.owner = owner
+        self.daemon = True
+        self.executor = concurrent.futures.ThreadPoolExecutor(workers)
+        self.blocking_executor = concurrent.futures.ThreadPoolExecutor(
+            blocking_workers)
+        # Keyed by whether the calls are to blocking methods.
+        self.workers = {False: workers, True: blocking_workers}
+        self.limit = {False: workers + queue_size,
+                      True: blocking_workers + queue_size}
+        self.running = {False: 0, True: 0}
+        self.rejected_calls = 0
+        self.metrics = metrics.Registry()
+        self.loop = asyncio.new_event_loop()
+        self.servers = transport.listen(self.address, backlog, reuse_port)
+        self.server = self.servers[0]
+        if self.address[1] == 0:
+            self.address = (address[0], self.server.getsockname()[1])
+        orb.register_skeleton(self)
+
+    # Private methods
+
+    async def _call(self, message, arrived):
+        """Run a request on the owner.
+
+        Return the reply together with the time the request waited for
+        a worker thread and the time it took to run. Like orb.WorkerPool,
+        refuse the request with an OverloadError if too many calls are
+        already running or waiting for a worker. Calls to blocking
+        methods are counted apart, as they have workers of their own.
+
+        """
+
+        blocking = orb.is_blocking(self.owner, message)
+        if self.running[blocking] >= self.limit[blocking]:
+            self.rejected_calls += 1
+            return orb.error_reply(orb.OverloadError(
+                "Too many requests are waiting to be served")), {}
+        expires = orb.request_deadline(message, arrived)
+        self.running[blocking] += 1
+        started = []
+        span = tracing.server_span(orb.method_name(message), self.address,
+                                   message.get("trace"))
+        token = tracing.activate(span)
+        deadline_token = orb.current_deadline.set(expires)
+        try:
+            if "batch" in message:
+                reply = {"result": [await self._invoke(call, started)
+                                    for call in message["batch"]]}
+            else:
+                reply = await self._invoke(message, started)
+        finally:
+            orb.current_deadline.reset(deadline_token)
+            tracing.deactivate(token)
+            self.running[blocking] -= 1
+        if span is not None:
+            span.finish("error" in reply)
+        started = started[0] if started else time.perf_counter()
+        return reply, {"queue": started - arrived,
+                       "exec": time.perf_counter() - started}
+
+    def _run(self, started, expires, context, fn, args):
+        """Run fn in a worker thread, noting when it started.
+
+        context holds the trace and the deadline of the call, which are
+        not passed on to the worker threads by the event loop.
+
+        """
+
+        started.append(time.perf_counter())
+        if expires is not None and started[-1] >= expires:
+            raise orb.DeadlineExceeded(
+                "The deadline passed before the call was run")
+        return context.run(fn, *args)
+
+    async def _invoke(self, message, started):
+        """Run a single call on the owner and return the reply."""
+
+        try:
+            fn = getattr(self.owner, message["method"])
+            if asyncio.iscoroutinefunction(fn):
+                started.append(time.perf_counter())
+                return orb.result_reply(message, await fn(*message["args"]))
+            args = (started, orb.current_deadline.get(),
+                    contextvars.copy_context(), _call_method, [fn, message])
+            executor = self.executor
+            if getattr(fn, "orb_blocking", False):
+                # Not in the executor, whose threads it could all take
+                # with the calls like it (see orb.blocking).
+                executor = self.blocking_executor
+            return await self.loop.run_in_executor(executor, self._run, *args)
+        except Exception as e:
+            print(e.__class__.__name__)
+            print(e)
+            return orb.error_reply(e)
+
+    async def _send_reply(self, writer, message, reply, codec, compressor):
+        """Send the reply to a framed request. Return its size."""
+
+        if writer.is_closing():
+            return 0
+        reply["id"] = message["id"]
+        data, flags = compression.pack(compressor,
+                                       orb.encode_reply(reply, codec))
+        writer.write(framing.pack_header(len(data), flags) + data)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            # The caller is gone, there is no one to reply to.
+            pass
+        return len(data)
+
+    async def _send_stream(self, writer, message, items, credit, codec,
+                           compressor, arrived):
+        """Send the elements of a streamed result, like Request.send_stream.
+
+        The elements are produced by the worker threads, as producing
+        one may take a while.
+
+        """
+
+        expires = orb.request_deadline(message, arrived)
+        done = object()
+        bytes_out = 0
+        reply = {"end": True}
+        try:
+            while True:
+                item = await self.loop.run_in_executor(
+                    self.executor, next, items, done)
+                if item is done:
+                    break
+                await credit.take(expires)
+                bytes_out += await self._send_reply(
+                    writer, message, {"item": item}, codec, compressor)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            reply = orb.error_reply(e)
+        finally:
+            if hasattr(items, "close"):
+                self.loop.run_in_executor(self.executor, _close, items)
+        bytes_out += await self._send_reply(writer, message, reply, codec,
+                                            compressor)
+        return reply, bytes_out
+
+    async def _serve_call(self, writer, message, codec, compressor,
+                          bytes_in, arrived, streams):
+        try:
+            reply, phases = await self._call(message, arrived)
+            bytes_out = 0
+            if "stream" in reply and not message.get("oneway"):
+                streams[message["id"]] = _StreamCredit(message["stream"])
+                reply, bytes_out = await self._send_stream(
+                    writer, message, reply["stream"],
+                    streams[message["id"]], codec, compressor, arrived)
+            elif not message.get("oneway"):
+                bytes_out = await self._send_reply(writer, message, reply,
+                                                   codec, compressor)
+        except asyncio.CancelledError:
+            # The client has cancelled the call, it wants no reply.
+            self.metrics.record(orb.method_name(message), True, bytes_in, 0)
+            return
+        finally:
+            streams.pop(message.get("id"), None)
+        self.metrics.record(orb.method_name(message), "error" in reply,
+                            bytes_in, bytes_out, **phases)
+
+    async def _serve_lines(self, reader, writer, request):
+        while request:
+            arrived = time.perf_counter()
+            message = {"method": "<invalid>"}
+            phases = {}
+            try:
+                message = codec.JSON.decode(request)
+                reply, phases = await self._call(message, arrived)
+            except ValueError as e:
+                reply = orb.error_reply(e)
+            data = orb.encode_reply(reply) + b"\n"
+            writer.write(data)
+            await writer.drain()
+            self.metrics.record(orb.method_name(message), "error" in reply,
+                                len(request), len(data), **phases)
+            request = await reader.readline()
+
+    async def _serve_frames(self, reader, writer, codec, compressor):
+        calls = {}
+        streams = {}
+        try:
+            await self._read_frames(reader, writer, codec, compressor,
+                                    calls, streams)
+        finally:
+            # No one is left to read the streams.
+            for call_id in list(streams):
+                if call_id in calls:
+                    calls[call_id].cancel()
+
+    async def _read_frames(self, reader, writer, codec, compressor, calls,
+                           streams):
+        while True:
+            try:
+                header = await reader.readexactly(framing.HEADER.size)
+            except asyncio.IncompleteReadError as e:
+                if e.partial:
+                    raise
+                break
+            length, flags = framing.unpack_header(header)
+            request = await reader.readexactly(length)
+            arrived = time.perf_counter()
+            message = codec.decode(
+                compression.unpack(compressor, request, flags))
+            if "cancel" in message:
+                if message["cancel"] in calls:
+                    calls[message["cancel"]].cancel()
+                continue
+            if "credit" in message:
+                if message["credit"] in streams:
+                    streams[message["credit"]].grant(message["count"])
+                continue
+            # Replies are sent by the calls themselves, in the order
+            # in which they finish. One-way calls are not replied to.
+            call = asyncio.ensure_future(self._serve_call(
+                writer, message, codec, compressor, len(request), arrived,
+                streams))
+            call_id = message.get("id", call)
+            calls[call_id] = call
+            call.add_done_callback(
+                lambda call, call_id=call_id: calls.pop(call_id, None))
+
+    async def _serve_connection(self, reader, writer):
+        try:
+            # The first message is always a line: either the handshake of
+            # a framing client or the request of a line client.
+            request = await reader.readline()
+            hello = orb.parse_handshake(request) if request else None
+            if hello is not None:
+                chosen = codec.choose(
+                    hello.get("codecs", []),
+                    transport.is_trusted_peer(
+                        writer.get_extra_info("socket")))
+                compressor = compression.choose(hello.get("compression"))
+                writer.write(orb.handshake_message(
+                    codec=chosen.name,
+                    compression=compression.name(compressor)))
+                await self._serve_frames(reader, writer, chosen, compressor)
+            else:
+                await self._serve_lines(reader, writer, request)
+        except Exception as e:
+            # Catch all errors in order to prevent the object from crashing
+            # due to bad connections coming from outside.
+            print("The connection to the caller has died:")
+            print("\t{}: {}".format(type(e), e))
+        finally:
+            writer.close()
+
+    async def _serve_local(self, message, arrived):
+        reply, phases = await self._call(message, arrived)
+        self.metrics.record(orb.method_name(message), "error" in reply,
+                            **phases)
+        return reply
+
+    async def _serve(self):
+        servers = []
+        for sock in self.servers:
+            if sock.family == socket.AF_INET:
+                start = asyncio.start_server
+            else:
+                start = asyncio.start_unix_server
+            servers.append(await start(self._serve_connection, sock=sock,
+                                       limit=LINE_LIMIT))
+        await asyncio.gather(*[server.serve_forever() for server in servers])
+
+    # Public methods
+
+    def call(self, message):
+        """Run a request made from this process.
+
+        Return the concurrent.futures.Future of its reply.
+
+        """
+
+        return asyncio.run_coroutine_threadsafe(
+            self._serve_local(message, time.perf_counter()), self.loop)
+
+    def queue_depth(self):
+        """Return the number of calls waiting for a worker thread."""
+
+        return sum(max(0, self.running[blocking] - self.workers[blocking])
+                   for blocking in self.running)
+
+    def rejected(self):
+        """Return the number of requests refused because of overload."""
+
+        return self.rejected_calls
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_until_complete(self._serve())
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,166 @@
+# -----------------------------------------------------------------------------
+# Distributed Systems (TDDD25)
+# -----------------------------------------------------------------------------
+# Author: Sergiu Rafiliu (sergiu.rafiliu@liu.se)
+# Modified: 31 July 2013
+#
+# Copyright 2012 Linkoping University
+# -----------------------------------------------------------------------------
+
+"""Circuit breakers and retry policies of the stubs.
+
+Every address the broker talks to has a circuit breaker. After a few
+calls in a row fail because the peer cannot be reached, the breaker
+opens: calls to the address then fail at once with PeerUnavailable
+instead of waiting for a connection to be refused or to time out. While
+the breaker is open, a thread probes the peer from time to time, waiting
+longer and longer between attempts, and closes the breaker as soon as
+the peer answers. Listeners are told whenever the breaker opens or
+closes.
+
+A RetryPolicy lists the methods that can safely be called again, and
+says how long to wait before doing so.
+
+"""
+
+import random
+import threading
+import time
+
+CLOSED = "closed"
+OPEN = "open"
+
+# Number of failures in a row after which a breaker opens.
+FAILURES = 3
+
+# Seconds between two probes of an unavailable peer, at first and at most.
+PROBE_INTERVAL = 0.5
+PROBE_MAX_INTERVAL = 10.0
+
+
+class CircuitBreaker(object):
+    """Keeps track of whether the peer at an address can be reached.
+
+    probe is called with no arguments to check if the peer is back. It
+    must raise an exception if it is not.
+
+    """
+
+    def __init__(self, address, probe, failures=FAILURES):
+        self.address = address
+        self.probe = probe
+        self.failures = failures
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.failed = 0
+        self.listeners = []
+
+    # Private methods
+
+    def _set_state(self, state):
+        """Change the state and return the listeners to tell about it."""
+
+        if state == self.state:
+            return []
+        self.state = state
+        return list(self.listeners)
+
+    def _notify(self, listeners, state):
+        for listener in listeners:
+            try:
+                listener(self.address, state)
+            except Exception as e:
+                print("A breaker listener has failed:")
+                print("\t{}: {}".format(type(e), e))
+
+    def _probe(self):
+        interval = PROBE_INTERVAL
+        while True:
+            time.sleep(interval)
+            try:
+                self.probe()
+                break
+            except Exception:
+                interval = min(interval * 2, PROBE_MAX_INTERVAL)
+        self.success()
+
+    # Public methods
+
+    def allow(self):
+        """Return True if a call to the peer may be attempted."""
+
+        return self.state == CLOSED
+
+    def success(self):
+        """Account for a call that reached the peer."""
+
+        self.lock.acquire()
+        try:
+            self.failed = 0
+            listeners = self._set_state(CLOSED)
+        finally:
+            self.lock.release()
+        self._notify(listeners, CLOSED)
+
+    def failure(self):
+        """Account for a call that could not reach the peer."""
+
+        self.lock.acquire()
+        try:
+            self.failed += 1
+            if self.failed < self.failures or self.state == OPEN:
+                return
+            listeners = self._set_state(OPEN)
+        finally:
+            self.lock.release()
+        thread = threading.Thread(target=self._probe)
+        thread.daemon = True
+        thread.start()
+        self._notify(listeners, OPEN)
+
+    def add_listener(self, listener):
+        """Call listener(address, state) whenever the state changes."""
+
+        self.lock.acquire()
+        try:
+            if listener not in self.listeners:
+                self.listeners.append(listener)
+        finally:
+            self.lock.release()
+
+    def remove_listener(self, listener):
+        self.lock.acquire()
+        try:
+            if listener in self.listeners:
+                self.listeners.remove(listener)
+        finally:
+            self.lock.release()
+
+
+class RetryPolicy(object):
+    """Says which calls to retry when the peer cannot be reached, and when.
+
+    Only the given methods are retried, as they must be idempotent: the
+    peer may have run a call whose reply was lost. A call is attempted
+    at most attempts times, waiting a random time of up to backoff
+    seconds, doubled at every attempt but never more than max_backoff,
+    before trying again.
+
+    """
+
+    def __init__(self, methods, attempts=3, backoff=0.05, max_backoff=1.0):
+        self.methods = frozenset(methods)
+        self.attempts = attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    def retries(self, method):
+        """Return the number of times a call to method may be retried."""
+
+        return self.attempts - 1 if method in self.methods else 0
+
+    def delay(self, attempt):
+        """Return the seconds to wait before the attempt-th retry."""
+
+        return random.uniform(0, min(self.max_backoff,
+                                     self.backoff * 2 ** attempt))
@@ -0,0 +1,127 @@
+# -----------------------------------------------------------------------------
+# Distributed Systems (TDDD25)
+# -----------------------------------------------------------------------------
+# Author: Sergiu Rafiliu (sergiu.rafiliu@liu.se)
+# Modified: 31 July 2013
+#
+# Copyright 2012 Linkoping University
+# -----------------------------------------------------------------------------
+
+"""Codecs used to serialize the messages of the Object Request Broker.
+
+A codec turns a message into bytes and back. The two ends of a framed
+connection agree on the codec during the handshake: the client offers
+the codecs it knows in order of preference and the server picks the
+first one it knows as well. JSON is always available and is the one
+used with peers that offer nothing, such as line protocol clients.
+
+Codecs that are not safe with data coming from strangers, such as
+marshal, are only offered to and chosen for trusted peers: those
+connected over a Unix domain socket and running as the same user (see
+transport.is_trusted_peer), or every peer if the ORB_TRUST_PEERS
+environment variable is set to 1. Other peers, even those of this host
+connected over TCP, use JSON.
+
+--  JsonCodec ::
+        Plain JSON text. Tuples become lists and the keys of
+        dictionaries become strings.
+--  MarshalCodec ::
+        Python's compact binary marshal format. Integers, bytes, tuples
+        and dictionaries with any keys are kept as they are, and both
+        encoding and decoding are done in C. The format is tied to the
+        marshal version, so peers running a Python with a different
+        version fall back to JSON. Like pickle, it is meant for peers
+        that trust each other, not for data coming from strangers.
+
+"""
+
+import json
+import marshal
+import os
+
+# Whether every peer is trusted with every codec.
+TRUST_PEERS = os.environ.get("ORB_TRUST_PEERS", "0") != "0"
+
+
+class JsonCodec(object):
+    """Codec sending messages as JSON text."""
+
+    name = "json"
+    # Whether data from strangers can be decoded safely.
+    safe = True
+
+    def encode(self, message):
+        return json.dumps(message).encode()
+
+    def decode(self, data):
+        # Frames come as memoryviews, which json cannot read; decoding
+        # them to text is the only copy made.
+        return json.loads(str(data, "utf-8"))
+
+
+class MarshalCodec(object):
+    """Codec sending messages in the binary marshal format."""
+
+    name = "marshal-{}".format(marshal.version)
+    safe = False
+
+    def encode(self, message):
+        return marshal.dumps(message)
+
+    def decode(self, data):
+        return marshal.loads(data)
+
+
+JSON = JsonCodec()
+MARSHAL = MarshalCodec()
+
+# Known codecs, the preferred ones first.
+codecs = [MARSHAL, JSON]
+
+
+def register(codec):
+    """Make codec known, preferring it to the codecs known so far."""
+
+    codecs.insert(0, codec)
+
+
+def _allowed(trusted):
+    """Return the known codecs that may be used with a peer."""
+
+    return [codec for codec in codecs
+            if trusted or TRUST_PEERS or getattr(codec, "safe", False)]
+
+
+def offer(trusted=True):
+    """Return the names of the codecs to offer to a peer.
+
+    Return them in order of preference, leaving out the unsafe ones
+    unless the peer is trusted.
+
+    """
+
+    return [codec.name for codec in _allowed(trusted)]
+
+
+def get(name):
+    """Return the codec with the given name, or JSON if it is unknown."""
+
+    for codec in codecs:
+        if codec.name == name:
+            return codec
+    return JSON
+
+
+def choose(names, trusted):
+    """Return the first of the offered codecs that is known here.
+
+    trusted tells whether the peer that offered them is trusted; the
+    unsafe codecs are left out otherwise.
+
+    """
+
+    known = dict((codec.name, codec) for codec in _allowed(trusted))
+    for name in names:
+        if name in known:
+            return known[name]
+    return JSON
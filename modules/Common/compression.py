@@ -0,0 +1,178 @@
+# -----------------------------------------------------------------------------
+# Distributed Systems (TDDD25)
+# -----------------------------------------------------------------------------
+# Author: Sergiu Rafiliu (sergiu.rafiliu@liu.se)
+# Modified: 31 July 2013
+#
+# Copyright 2012 Linkoping University
+# -----------------------------------------------------------------------------
+
+"""Compression of the frames of the Object Request Broker.
+
+Like the codec, the compressor of a framed connection is agreed on
+during the handshake: the client offers the ones it knows in order of
+preference and the server picks the first one it knows as well, or none
+at all. Each end then compresses the frames it sends that are larger
+than THRESHOLD bytes, and marks them with the framing.COMPRESSED flag;
+smaller frames, which would barely shrink, are sent as they are.
+
+--  ZlibCompressor ::
+        zlib (deflate) from the standard library. Every frame is
+        compressed on its own, so frames can be sent and received in
+        any order. The "zlib-dict" variant primes the compressor with a
+        dictionary of the text the messages of the broker are made of,
+        so that frames just above the threshold shrink as well.
+
+Compression is only offered to peers of other hosts, as between the
+peers of a host it costs more time than it saves. It is turned off
+altogether by setting the ORB_COMPRESSION environment variable to
+"none".
+
+"""
+
+import os
+import zlib
+
+from . import codec
+from . import framing
+from . import transport
+
+# Frames of this many bytes or less are never compressed.
+THRESHOLD = int(os.environ.get("ORB_COMPRESS_THRESHOLD", 512))
+
+# zlib compression level, from 1 (fastest) to 9 (smallest). Messages
+# are mostly JSON text, which the fastest level already shrinks well.
+LEVEL = 1
+
+
+def _dictionary():
+    """Return the preset dictionary of the zlib-dict compressor.
+
+    It holds JSON text of the messages a connection is made of, the most
+    frequent ones last as zlib finds those more cheaply. The marshal
+    codec shares their strings. The dictionary must be the same on every
+    peer, so it is never built from anything that depends on the version
+    of Python.
+
+    """
+
+    samples = [
+        {"method": "require_all", "args": ["peer"]},
+        {"method": "register_peer", "args": [0, ["127.0.0.1", 0]]},
+        {"method": "unregister_peer", "args": [0]},
+        {"method": "request_token", "args": [0, 0]},
+        {"method": "obtain_token", "args": [{}], "oneway": True},
+        {"method": "write_no_lock", "args": ["fortune"]},
+        {"method": "check", "args": []},
+        {"error": {"name": "Exception", "args": ["error"]}, "id": 0},
+        {"batch": [{"method": "read", "args": []}]},
+        {"method": "read", "args": [], "id": 0, "deadline": 1.0,
+         "trace": ["0000000000000000", "0000000000000000"]},
+        {"method": "write", "args": ["fortune"], "id": 0},
+        {"result": "fortune", "id": 0},
+    ]
+    return b"".join(codec.JSON.encode(sample) for sample in samples)
+
+
+class ZlibCompressor(object):
+    """Compresses frames with zlib, optionally with a preset dictionary."""
+
+    def __init__(self, name, dictionary=None, level=LEVEL):
+        self.name = name
+        self.dictionary = dictionary
+        self.level = level
+
+    def compress(self, data):
+        if self.dictionary is None:
+            return zlib.compress(data, self.level)
+        compressor = zlib.compressobj(self.level, zdict=self.dictionary)
+        return compressor.compress(data) + compressor.flush()
+
+    def decompress(self, data):
+        """Return the decompressed data of a frame.
+
+        Raise zlib.error if it would be larger than framing.MAX_FRAME,
+        without decompressing the rest of it.
+
+        """
+
+        if self.dictionary is None:
+            decompressor = zlib.decompressobj()
+        else:
+            decompressor = zlib.decompressobj(zdict=self.dictionary)
+        data = decompressor.decompress(data, framing.MAX_FRAME)
+        if decompressor.unconsumed_tail:
+            raise zlib.error(
+                "The compressed frame is larger than {} bytes".format(
+                    framing.MAX_FRAME))
+        if not decompressor.eof:
+            raise zlib.error("The compressed frame is truncated")
+        return data
+
+
+ZLIB_DICT = ZlibCompressor("zlib-dict-1", _dictionary())
+ZLIB = ZlibCompressor("zlib")
+
+# Known compressors, the preferred ones first.
+compressors = [ZLIB_DICT, ZLIB]
+if os.environ.get("ORB_COMPRESSION") == "none":
+    compressors = []
+
+
+def offer(address=None):
+    """Return the names of the compressors to offer to the peer at address.
+
+    Return them all, in order of preference, unless the peer is on this
+    host.
+
+    """
+
+    if address is not None and transport.is_local(address[0]):
+        return []
+    return [compressor.name for compressor in compressors]
+
+
+def get(name):
+    """Return the compressor with the given name, or None if it is unknown."""
+
+    for compressor in compressors:
+        if compressor.name == name:
+            return compressor
+    return None
+
+
+def choose(names):
+    """Return the first of the offered compressors known here, or None."""
+
+    known = dict((compressor.name, compressor) for compressor in compressors)
+    for name in names or []:
+        if name in known:
+            return known[name]
+    return None
+
+
+def name(compressor):
+    """Return the name to announce in the handshake for compressor."""
+
+    return compressor.name if compressor is not None else None
+
+
+def pack(compressor, data):
+    """Return the (payload, flags) of a frame carrying data."""
+
+    if compressor is None or len(data) <= THRESHOLD:
+        return data, 0
+    compressed = compressor.compress(data)
+    if len(compressed) >= len(data):
+        return data, 0
+    return compressed, framing.COMPRESSED
+
+
+def unpack(compressor, payload, flags):
+    """Return the data carried by a frame with the given payload and flags."""
+
+    if not flags & framing.COMPRESSED:
+        return payload
+    if compressor is None:
+        raise ValueError("Received a compressed frame, but none was agreed on")
+    return compressor.decompress(payload)
@@ -0,0 +1,193 @@
+# -----------------------------------------------------------------------------
+# Distributed Systems (TDDD25)
+# -----------------------------------------------------------------------------
+# Author: Sergiu Rafiliu (sergiu.rafiliu@liu.se)
+# Modified: 31 July 2013
+#
+# Copyright 2012 Linkoping University
+# -----------------------------------------------------------------------------
+
+"""Length-prefixed framing of messages sent over stream sockets.
+
+Every frame starts with an 8 byte big-endian header followed by the
+payload. The lower 56 bits of the header hold the length of the payload
+and the top byte holds the flags of the frame, such as COMPRESSED.
+
+A Reader receives with recv_into into a buffer of its own that it uses
+over and over, so that a single system call may bring in several small
+frames, and hands out the payloads as memoryviews of that buffer,
+without copying them. Payloads larger than the buffer are received
+directly into a buffer of the right size, so they are never truncated
+or copied chunk by chunk; a frame announcing more than MAX_FRAME bytes
+is refused before anything is allocated for it. Frames are sent with
+sendmsg where sockets have it, so that large payloads are not copied
+just to be put behind their header.
+
+"""
+
+import os
+import struct
+
+HEADER = struct.Struct("!Q")
+LENGTH_MASK = (1 << 56) - 1
+FLAGS_SHIFT = 56
+
+# Flags of a frame.
+COMPRESSED = 0x01  # The payload is compressed (see the compression module).
+
+# Size of the buffer of a Reader.
+BUFFER_SIZE = 1 << 16
+
+# Largest payload a frame may carry, also once decompressed, so that a
+# peer cannot make us allocate any amount of memory.
+MAX_FRAME = int(os.environ.get("ORB_MAX_FRAME", 1 << 28))
+
+# Payloads smaller than this are copied behind their header and sent
+# with sendall, which is cheaper than gathering them with sendmsg.
+GATHER_SIZE = 1 << 12
+
+
+def pack_header(length, flags=0):
+    """Return the header of a frame carrying length bytes."""
+
+    return HEADER.pack((flags << FLAGS_SHIFT) | length)
+
+
+def unpack_header(header, offset=0):
+    """Return the (length, flags) announced by the header of a frame.
+
+    Raise ValueError if the length is larger than MAX_FRAME.
+
+    """
+
+    value = HEADER.unpack_from(header, offset)[0]
+    length = value & LENGTH_MASK
+    if length > MAX_FRAME:
+        raise ValueError("A frame of {} bytes is too large".format(length))
+    return length, value >> FLAGS_SHIFT
+
+
+def send_frame(sock, payload, flags=0):
+    """Send payload over sock as a single frame."""
+
+    header = pack_header(len(payload), flags)
+    if len(payload) < GATHER_SIZE or not hasattr(sock, "sendmsg"):
+        sock.sendall(header + payload)
+        return
+    sent = sock.sendmsg([header, payload])
+    if sent < len(header):
+        sock.sendall(header[sent:])
+        sent = len(header)
+    if sent < len(header) + len(payload):
+        sock.sendall(memoryview(payload)[sent - len(header):])
+
+
+class Reader(object):
+    """Buffered reader of the frames and lines received on a socket.
+
+    The payload returned by read_frame is only valid until the next
+    call to read_frame or read_line, as the buffer it lies in is then
+    reused: it must be decoded (or copied) before reading on. Lines are
+    only used by the text protocol and by the handshake that precedes
+    the framed protocol, and are returned as bytes.
+
+    """
+
+    def __init__(self, sock, size=BUFFER_SIZE):
+        self.socket = sock
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        # The bytes received but not handed out yet are those of
+        # buffer[start:end].
+        self.start = 0
+        self.end = 0
+
+    # Private methods
+
+    def _compact(self):
+        """Move the bytes not handed out yet to the start of the buffer."""
+
+        pending = self.end - self.start
+        if self.start and pending:
+            self.buffer[:pending] = self.buffer[self.start:self.end]
+        self.start, self.end = 0, pending
+
+    def _receive(self):
+        """Receive more bytes. Return False at the end of the stream."""
+
+        if self.end == len(self.buffer):
+            self._compact()
+        received = self.socket.recv_into(self.view[self.end:])
+        self.end += received
+        return received > 0
+
+    def _fill(self, count):
+        """Buffer count bytes. Return False on a clean end of stream."""
+
+        if self.start + count > len(self.buffer):
+            self._compact()
+        while self.end - self.start < count:
+            if not self._receive():
+                if self.end == self.start:
+                    return False
+                raise EOFError("The connection was closed in mid-frame")
+        return True
+
+    def _read_large(self, length):
+        """Return a payload larger than the buffer, in a buffer of its own."""
+
+        payload = bytearray(length)
+        view = memoryview(payload)
+        filled = min(length, self.end - self.start)
+        view[:filled] = self.view[self.start:self.start + filled]
+        self.start += filled
+        while filled < length:
+            received = self.socket.recv_into(view[filled:])
+            if received == 0:
+                raise EOFError("The connection was closed in mid-frame")
+            filled += received
+        return payload
+
+    # Public methods
+
+    def read_frame(self):
+        """Return the (payload, flags) of the next frame.
+
+        Return (None, 0) if the peer closed the connection between two
+        frames.
+
+        """
+
+        if not self._fill(HEADER.size):
+            return None, 0
+        length, flags = unpack_header(self.buffer, self.start)
+        self.start += HEADER.size
+        if length > len(self.buffer):
+            return self._read_large(length), flags
+        if length and not self._fill(length):
+            raise EOFError("The connection was closed in mid-frame")
+        payload = self.view[self.start:self.start + length]
+        self.start += length
+        return payload, flags
+
+    def read_line(self):
+        """Return the next line, or b"" if the connection was closed."""
+
+        # Lines longer than the buffer are put together in here.
+        line = bytearray()
+        scanned = self.start
+        while True:
+            end = self.buffer.find(b"\n", scanned, self.end)
+            if end >= 0:
+                line += self.view[self.start:end + 1]
+                self.start = end + 1
+                return bytes(line)
+            if self.start == 0 and self.end == len(self.buffer):
+                line += self.view[:self.end]
+                self.start = self.end = 0
+            scanned = self.end - self.start
+            if not self._receive():
+                line += self.view[self.start:self.end]
+                self.start = self.end
+                return bytes(line)
+            scanned += self.start
@@ -0,0 +1,158 @@
+# -----------------------------------------------------------------------------
+# Distributed Systems (TDDD25)
+# -----------------------------------------------------------------------------
+# Author: Sergiu Rafiliu (sergiu.rafiliu@liu.se)
+# Modified: 31 July 2013
+#
+# Copyright 2012 Linkoping University
+# -----------------------------------------------------------------------------
+
+"""Per-method call metrics of the Object Request Broker.
+
+Every skeleton keeps a Registry of the calls it has served, and the
+stubs of a process share the client Registry below. For every method a
+registry counts the calls, the errors and the bytes received and sent,
+and keeps a latency histogram of each phase of the calls:
+
+--  server side ::
+        queue (waiting for a worker) and exec (running the method),
+--  client side ::
+        connect (opening the connection, when the call had to),
+        send (serializing and sending the request) and wait (until
+        the reply arrived).
+
+Peers return the snapshot of their metrics from their stats method, and
+write it to the file named by the ORB_STATS_FILE environment variable
+when they are destroyed.
+
+"""
+
+import bisect
+import json
+import os
+import threading
+import time
+
+# Upper bounds of the histogram buckets, in seconds: from 10us to about
+# 84s, each bucket twice as wide as the one before it.
+BOUNDS = [0.00001 * 2 ** i for i in range(24)]
+
+STATS_FILE = os.environ.get("ORB_STATS_FILE")
+
+
+class Histogram(object):
+    """Histogram of durations, with exponentially growing buckets."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, duration):
+        self.counts[bisect.bisect_left(BOUNDS, duration)] += 1
+        self.count += 1
+        self.total += duration
+        self.max = max(self.max, duration)
+
+    def percentile(self, p):
+        """Return the upper bound of the bucket holding the p-th percentile."""
+
+        if self.count == 0:
+            return 0.0
+        rank = p / 100.0 * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count:
+                return BOUNDS[i] if i < len(BOUNDS) else self.max
+        return self.max
+
+    def snapshot(self):
+        return {
+            "count": self.count,
+            "mean": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p90": self.percentile(90),
+            "p99": self.percentile(99),
+            "buckets": [[bound, count] for bound, count
+                        in zip(BOUNDS + [None], self.counts) if count]
+        }
+
+
+class MethodStats(object):
+    """Counters and latency histograms of the calls to one method."""
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.latency = {}
+
+    def snapshot(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "bytes_in": self.bytes_in,
+            "bytes_out": self.bytes_out,
+            "latency": dict((phase, histogram.snapshot())
+                            for phase, histogram in self.latency.items())
+        }
+
+
+class Registry(object):
+    """Thread safe collection of the metrics of all the called methods."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.methods = {}
+        self.started = time.time()
+
+    def record(self, method, error=False, bytes_in=0, bytes_out=0,
+               **phases):
+        """Account for one call, phases giving the duration of each phase."""
+
+        self.lock.acquire()
+        try:
+            stats = self.methods.get(method)
+            if stats is None:
+                stats = self.methods[method] = MethodStats()
+            stats.calls += 1
+            stats.errors += bool(error)
+            stats.bytes_in += bytes_in
+            stats.bytes_out += bytes_out
+            for phase, duration in phases.items():
+                if phase not in stats.latency:
+                    stats.latency[phase] = Histogram()
+                stats.latency[phase].add(duration)
+        finally:
+            self.lock.release()
+
+    def snapshot(self):
+        """Return the metrics as a dictionary of plain values."""
+
+        self.lock.acquire()
+        try:
+            return {
+                "uptime": time.time() - self.started,
+                "methods": dict((method, stats.snapshot())
+                                for method, stats in self.methods.items())
+            }
+        finally:
+            self.lock.release()
+
+
+# Metrics of the calls made by all the stubs of this process.
+client = Registry()
+
+
+def dump(stats, path=None):
+    """Append stats as a line of JSON to path (by default STATS_FILE)."""
+
+    path = path or STATS_FILE
+    if not path:
+        return
+    with open(path, "a") as f:
+        f.write(json.dumps(stats) + "\n")
@@ -10,6 +10,23 @@
 import threading
 import socket
 import json
+import collections.abc
+import concurrent.futures
+import contextlib
+import contextvars
+import os
+import queue
+import struct
+import time
+
+from . import breaker
+from . import codec
+from . import compression
+from . import framing
+from . import metrics
+from . import resolver
+from . import tracing
+from . import transport
 
 """Object Request Broker
 
@@ -27,99 +44,1621 @@ objects that communicate via networks. This infrastructure consists of:
         communication. Any object wishing to transparently interact with
         remote objects should extend this class.
 
+Requests and replies are JSON messages sent as length-prefixed frames
+(see the framing module). A connection starts with a one line JSON
+handshake; peers that do not answer it, such as the name service, are
+talked to with the original protocol of one JSON message per line.
+Framed requests carry an id that is sent back with their reply, so
+that many calls can share one connection at the same time. The codec
+used for framed messages is agreed on during the handshake (see the
+codec module), and so is the compression of the large ones (see the
+compression module); the line protocol always uses JSON and is never
+compressed. Messages also carry the context of the trace they belong to
+(see the tracing module).
+
+A call may be given a deadline, either by the timeout of its stub or by
+the deadline context manager. The time left is sent along with the
+request; the server skips the request if it expires before a worker
+gets to it, and the calls made while serving it inherit what is left of
+it. A caller that stops waiting cancels its call, which drops it from
+the server's queue if it has not started yet.
+
+Connections are made over the transports of the transport module, so
+peers of the same host talk over Unix domain sockets. A stub of a peer
+that lives in the same process bypasses the network altogether: its
+calls are handed over to the skeleton of the peer directly (see
+LoopbackConnection).
+
+A method may return an iterator, such as a generator. A caller that
+asks for a stream (see RemoteMethod.stream) then gets the elements one
+frame at a time, as the server produces them; the server stays at most
+STREAM_WINDOW elements ahead of the caller, which asks for more as it
+consumes them. Streams are sent by workers of their own, so that those
+waiting for their callers do not hold up other calls. Other callers get
+the elements as a list.
+
+Calls to a peer that cannot be reached fail fast with PeerUnavailable
+once the circuit breaker of its address has opened (see the breaker
+module), and stubs given a RetryPolicy call idempotent methods again
+when the peer could not be reached.
+
 """
 
 
+# The runtime used by the skeletons of peers: "threads" runs every
+# connection and call in a thread of its own, "asyncio" serves them from
+# an event loop (see the asyncOrb module).
+RUNTIME = os.environ.get("ORB_RUNTIME", "threads")
+
+
+# Default size of the worker pool of a skeleton, of the queue of
+# requests waiting for a worker, and of the backlog of connections
+# waiting to be accepted.
+WORKERS = 32
+QUEUE_SIZE = 256
+BACKLOG = 128
+
+# Default size of the pool of the workers running the calls to blocking
+# methods (see blocking).
+BLOCKING_WORKERS = 32
+
+# Seconds given to a peer to answer the probes of its circuit breaker.
+PROBE_TIMEOUT = 2.0
+
+# Seconds a cancelled call waits to tell the server about it, before
+# leaving the server to find out at the deadline of the call.
+CANCEL_TIMEOUT = 0.1
+
+# Number of elements of a stream sent ahead of those consumed, and the
+# seconds a server waits for a caller to ask for more before giving up.
+STREAM_WINDOW = 32
+STREAM_IDLE_TIMEOUT = 60.0
+
+# Default size of the pool of the workers sending streams.
+STREAM_WORKERS = 32
+
+
 class ComunicationError(Exception):
     pass
 
 
-class Stub(object):
-    """ Stub for generic objects distributed over the network.
+class OverloadError(ComunicationError):
+    """The server has too many requests waiting and refused this one."""
+    pass
+
+
+class DeadlineExceeded(ComunicationError):
+    """The call did not complete before its deadline."""
+    pass
+
+
+class PeerUnavailable(ComunicationError):
+    """The peer has not been reachable lately, so the call was not made."""
+    pass
+
+
+# Errors of the broker itself, raised as such on the client side instead
+# of as a class created on the fly from the name of the remote error.
+_errors = {
+    "OverloadError": OverloadError,
+    "DeadlineExceeded": DeadlineExceeded,
+}
+
+
+# The time (as given by time.perf_counter) by which the calls made now
+# must complete, or None if they may take as long as they need.
+current_deadline = contextvars.ContextVar("current_deadline", default=None)
+
 
-    This is  wrapper object for a socket.
+@contextlib.contextmanager
+def deadline(seconds):
+    """Make the calls of a with block complete within seconds.
+
+    A deadline set by an enclosing block, or inherited from the request
+    being served, still applies if it is the earlier one.
+
+    """
+
+    token = current_deadline.set(expiry(seconds))
+    try:
+        yield
+    finally:
+        current_deadline.reset(token)
+
+
+def expiry(timeout=None):
+    """Return the deadline of a call made now with the given timeout."""
+
+    expires = current_deadline.get()
+    if timeout is not None:
+        expires = min(expires or float("inf"), time.perf_counter() + timeout)
+    return expires
+
+
+def time_left(expires):
+    """Return the seconds left until expires, or None if it is None."""
+
+    if expires is None:
+        return None
+    return max(0.0, expires - time.perf_counter())
+
+
+def request_deadline(message, arrived):
+    """Return the deadline of a request that arrived at the given time."""
+
+    if message.get("deadline") is None:
+        return None
+    return arrived + message["deadline"]
+
+
+def expire(future):
+    """Cancel a call whose deadline has passed.
+
+    Unlike the calls cancelled by their callers, these count as failures
+    of the peer for its circuit breaker (see Channel).
+
+    """
+
+    future.expired = True
+    future.cancel()
+
+
+def wait(future, expires):
+    """Return the result of a call, cancelling it if expires passes first."""
+
+    try:
+        return future.result(time_left(expires))
+    except concurrent.futures.TimeoutError:
+        expire(future)
+        raise DeadlineExceeded("The call did not complete in time")
+
+
+def handshake_message(**hello):
+    """Return the handshake line exchanged at the start of a connection.
+
+    The client offers the codecs and compressors it knows, the server
+    answers with the ones it has chosen.
+
+    """
+
+    hello["framing"] = 1
+    return (json.dumps({"hello": hello}) + "\n").encode()
+
+
+def parse_handshake(line):
+    """Return the contents of a handshake line, or None if it is not one."""
+
+    try:
+        message = json.loads(line.decode())
+    except ValueError:
+        return None
+    if not isinstance(message, dict) or "hello" not in message:
+        return None
+    return message["hello"]
+
+
+def result_reply(message, result):
+    """Pack the result of a call into a reply.
+
+    An iterator is kept as it is, to be streamed, if the caller asked
+    for a stream, and turned into a list otherwise.
+
+    """
+
+    if isinstance(result, collections.abc.Iterator):
+        if message.get("stream"):
+            return {"stream": result}
+        result = list(result)
+    return {"result": result}
+
+
+def collect(reply):
+    """Return a reply with its stream, if any, turned into a list."""
+
+    if "stream" not in reply:
+        return reply
+    try:
+        output = {"result": list(reply["stream"])}
+    except Exception as e:
+        output = error_reply(e)
+    if "id" in reply:
+        output["id"] = reply["id"]
+    return output
+
+
+def encode_reply(reply, codec=codec.JSON):
+    """Serialize a reply, replacing it with an error if that fails.
+
+    A stream is sent whole, as a list.
+
+    """
+
+    reply = collect(reply)
+    try:
+        return codec.encode(reply)
+    except (TypeError, ValueError) as e:
+        return codec.encode(dict(error_reply(e), id=reply.get("id")))
+
+
+def error_reply(e):
+    """Pack an exception into a reply."""
+
+    return {"error": {"name": e.__class__.__name__, "args": e.args}}
+
+
+def unpack_reply(output):
+    """Return the result carried by a reply or raise the remote error."""
+
+    if "error" in output:
+        name, args = output["error"]["name"], output["error"]["args"]
+        if name in _errors:
+            raise _errors[name](*args)
+        exception = type(name, (Exception,), {})
+        raise exception(args)
+    return output["result"]
+
+
+def _resolve(future, output):
+    """Complete a call's future with the reply received for it."""
+
+    try:
+        try:
+            future.set_result(unpack_reply(output))
+        except Exception as e:
+            future.set_exception(e)
+    except concurrent.futures.InvalidStateError:
+        # The caller has cancelled the call in the meantime.
+        pass
+
+
+def method_name(message):
+    """Return the name under which the metrics of a request are kept."""
+
+    return message.get("method", "<batch>")
+
+
+class PendingCall(object):
+    """A request sent by a stub, together with the metrics of the call."""
+
+    def __init__(self, message, connect=None):
+        self.future = concurrent.futures.Future()
+        self.method = method_name(message)
+        self.phases = {}
+        if connect is not None:
+            self.phases["connect"] = connect
+        self.bytes_out = 0
+        self.bytes_in = 0
+        # Until sent is called, which the reply may beat.
+        self.sent_at = time.perf_counter()
+        self.stream = None
+
+    def sent(self, bytes_out, started):
+        """Account for the request having been sent."""
+
+        self.sent_at = time.perf_counter()
+        self.bytes_out = bytes_out
+        self.phases["send"] = self.sent_at - started
+
+    def finish(self, output, bytes_in):
+        """Complete the call with the reply received for it."""
+
+        self.phases["wait"] = time.perf_counter() - self.sent_at
+        metrics.client.record(self.method, "error" in output, bytes_in,
+                              self.bytes_out, **self.phases)
+        _resolve(self.future, output)
+
+    def receive(self, output, bytes_in):
+        """Handle a frame of a streamed result.
+
+        The call completes with the stream itself as soon as the first
+        frame arrives; the elements are then handed to the stream.
+
+        """
+
+        self.bytes_in += bytes_in
+        try:
+            self.future.set_result(self.stream)
+        except concurrent.futures.InvalidStateError:
+            pass
+        if "item" in output:
+            self.stream.put("item", output["item"])
+            return
+        self.phases["wait"] = time.perf_counter() - self.sent_at
+        metrics.client.record(self.method, "error" in output, self.bytes_in,
+                              self.bytes_out, **self.phases)
+        try:
+            if "error" in output:
+                unpack_reply(output)
+            self.stream.put("end", None)
+        except Exception as e:
+            self.stream.put("error", e)
+
+    def fail(self, error):
+        """Complete the call with an error of the broker."""
+
+        metrics.client.record(self.method, True, 0, self.bytes_out)
+        try:
+            self.future.set_exception(error)
+        except concurrent.futures.InvalidStateError:
+            pass
+        if self.stream is not None:
+            self.stream.put("error", error)
+
+
+class Stream(object):
+    """Iterator over a result that the server streams element by element.
+
+    The server sends at most window elements ahead of those consumed,
+    and more are asked for as the iterator goes. Closing the stream
+    before its end cancels the rest of the call:
+
+        with stub.dump.stream() as fortunes:
+            for fortune in fortunes:
+                ...
+
+    Iterating raises DeadlineExceeded once the deadline of the call has
+    passed, and any error the server runs into along the way.
+
+    """
+
+    def __init__(self, conn, call_id, window, expires):
+        self.conn = conn
+        self.call_id = call_id
+        self.window = window
+        self.expires = expires
+        self.queue = queue.Queue()
+        self.consumed = 0
+        self.done = False
+
+    def put(self, kind, value):
+        self.queue.put((kind, value))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.done:
+            raise StopIteration
+        try:
+            kind, value = self.queue.get(timeout=time_left(self.expires))
+        except queue.Empty:
+            self.close()
+            raise DeadlineExceeded("The stream did not complete in time")
+        if kind == "item":
+            self.consumed += 1
+            # Ask for more once half of the window has been consumed, so
+            # that the server need not wait for the request.
+            if self.consumed >= max(1, self.window // 2):
+                self.conn.grant(self.call_id, self.consumed)
+                self.consumed = 0
+            return value
+        self.done = True
+        if kind == "error":
+            raise value
+        raise StopIteration
+
+    def close(self):
+        """Stop the stream, telling the server to stop as well."""
+
+        if not self.done:
+            self.done = True
+            self.conn.cancel(self.call_id)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def peer_failed(error):
+    """Return True if error means that the call could not reach the peer."""
+
+    return isinstance(error, (PeerUnavailable, ConnectionClosed,
+                              socket.error))
+
+
+class ConnectionClosed(ComunicationError):
+    """The connection was lost before the request could be sent."""
+    pass
+
+
+class _SendDeadline(object):
+    """The sending side of a socket, giving up once expires passes.
+
+    Every send is bounded by the time left with SO_SNDTIMEO, which
+    leaves the receiving side of the socket alone. Raise socket.timeout
+    once expires has passed; sent tells how much was sent before.
+
+    """
+
+    def __init__(self, sock, expires):
+        self.sock = sock
+        self.expires = expires
+        self.sent = 0
+
+    def _arm(self):
+        timeout = time_left(self.expires)
+        if timeout <= 0:
+            raise socket.timeout("The send did not complete in time")
+        # A zero timeval would mean no timeout at all.
+        seconds, micros = divmod(max(1, int(timeout * 1e6)), 1000000)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO,
+                             struct.pack("ll", seconds, micros))
+
+    def sendmsg(self, buffers):
+        self._arm()
+        try:
+            sent = self.sock.sendmsg(buffers)
+        except BlockingIOError:
+            raise socket.timeout("The send did not complete in time")
+        self.sent += sent
+        return sent
+
+    def sendall(self, data):
+        view = memoryview(data).cast("B")
+        while view:
+            self._arm()
+            try:
+                sent = self.sock.send(view)
+            except BlockingIOError:
+                raise socket.timeout("The send did not complete in time")
+            self.sent += sent
+            view = view[sent:]
+
+    def reset(self):
+        """Let the sends of the socket take as long as they take again."""
+
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDTIMEO,
+                             struct.pack("ll", 0, 0))
+
+
+class Connection(object):
+    """A multiplexed connection to a remote address.
+
+    After the handshake, requests are sent as frames tagged with an id
+    as soon as they are made, without waiting for the replies to the
+    previous ones. A reader thread matches the replies, which may come
+    back in any order, with the calls waiting for them.
+
+    Frames are sent one at a time, under send_lock rather than lock, so
+    that a slow send holds up neither the replies nor the calls whose
+    deadline passes while they wait for it. A send that does not
+    complete by the deadline of its call closes the connection, as the
+    frames that follow could not be told apart from what is left of it.
+
+    """
+
+    def __init__(self, address, timeout=None):
+        self.address = address
+        self.socket = transport.connect(address, timeout)
+        self.reader = framing.Reader(self.socket)
+        self.lock = threading.Lock()
+        self.send_lock = threading.Lock()
+        # Whether SO_SNDTIMEO is set on the socket. Sockets of other
+        # transports, which have no such option, are never bounded.
+        self.bounded = False
+        self.boundable = isinstance(self.socket, socket.socket)
+        self.pending = {}
+        self.next_id = 0
+        self.closed = False
+        self.codec = codec.JSON
+        self.compressor = None
+        try:
+            self.accepted = self._handshake()
+        except socket.timeout:
+            self.socket.close()
+            raise
+        # The timeout only bounds the opening of the connection; the
+        # reader thread waits for replies for as long as it takes.
+        self.socket.settimeout(None)
+        if self.accepted:
+            thread = threading.Thread(target=self._read_replies)
+            thread.daemon = True
+            thread.start()
+
+    # Private methods
+
+    def _handshake(self):
+        """Offer the framed protocol. Return True if it was accepted."""
+
+        trusted = transport.is_trusted_peer(self.socket)
+        self.socket.sendall(handshake_message(
+            codecs=codec.offer(trusted),
+            compression=compression.offer(self.address)))
+        hello = parse_handshake(self.reader.read_line())
+        if hello is None:
+            return False
+        # Only one of the codecs offered, whatever the server says.
+        self.codec = codec.choose([hello.get("codec")], trusted)
+        self.compressor = compression.get(hello.get("compression"))
+        return True
+
+    def _read_replies(self):
+        try:
+            while True:
+                reply, flags = self.reader.read_frame()
+                if reply is None:
+                    break
+                output = self.codec.decode(
+                    compression.unpack(self.compressor, reply, flags))
+                self.lock.acquire()
+                try:
+                    call = self.pending.get(output["id"])
+                    if "item" not in output:
+                        self.pending.pop(output["id"], None)
+                finally:
+                    self.lock.release()
+                if call is None:
+                    continue
+                if call.stream is not None and "result" not in output and (
+                        "error" not in output or call.future.done()):
+                    call.receive(output, len(reply))
+                else:
+                    call.finish(output, len(reply))
+        except Exception:
+            pass
+        finally:
+            self.close()
+
+    def _send_frame(self, data, flags=0, expires=None):
+        """Send a frame, giving up once expires passes.
+
+        Raise DeadlineExceeded if it could not be sent in time, having
+        closed the connection if part of it was sent.
+
+        """
+
+        timeout = time_left(expires)
+        if not self.send_lock.acquire(
+                timeout=-1 if timeout is None else timeout):
+            raise DeadlineExceeded(
+                "Could not send to {} in time".format(self.address))
+        try:
+            if self.closed:
+                raise ConnectionClosed("The connection has been closed")
+            sock = self.socket
+            if self.boundable and expires is not None:
+                sock = _SendDeadline(sock, expires)
+                self.bounded = True
+            elif self.bounded:
+                _SendDeadline(sock, None).reset()
+                self.bounded = False
+            try:
+                framing.send_frame(sock, data, flags)
+                torn = None
+            except socket.timeout:
+                torn = sock.sent > 0
+        finally:
+            self.send_lock.release()
+        if torn is not None:
+            if torn:
+                self.close()
+            raise DeadlineExceeded(
+                "Could not send to {} in time".format(self.address))
+
+    def _control(self, message, expires):
+        """Send a message about a call already sent."""
+
+        try:
+            self._send_frame(self.codec.encode(message), 0, expires)
+        except (ComunicationError, socket.error):
+            # The connection is lost, and the call along with it.
+            pass
+
+    def _forget(self, message):
+        """Drop a call that could not be sent."""
+
+        self.lock.acquire()
+        try:
+            self.pending.pop(message.get("id"), None)
+        finally:
+            self.lock.release()
+
+    def _cancelled(self, call_id, future):
+        """Tell the server to drop a call whose caller gave up on it."""
+
+        if future.cancelled():
+            self.cancel(call_id)
+
+    # Public methods
+
+    def cancel(self, call_id):
+        """Tell the server to drop a call, or the rest of its stream."""
+
+        self.lock.acquire()
+        try:
+            call = self.pending.pop(call_id, None)
+            if call is None or self.closed:
+                return
+        finally:
+            self.lock.release()
+        self._control({"cancel": call_id},
+                      time.perf_counter() + CANCEL_TIMEOUT)
+        metrics.client.record(call.method, True, 0, call.bytes_out)
+
+    def grant(self, call_id, count):
+        """Let the server send count more elements of a stream."""
+
+        self.lock.acquire()
+        try:
+            call = self.pending.get(call_id)
+            if call is None or self.closed:
+                return
+        finally:
+            self.lock.release()
+        self._control({"credit": call_id, "count": count},
+                      call.stream.expires)
+
+    def submit(self, message, connect=None):
+        """Send a request and return the future of its result.
+
+        connect is the time it took to open the connection, if it was
+        opened for this request.
+
+        """
+
+        started = time.perf_counter()
+        call = PendingCall(message, connect)
+        oneway = message.get("oneway", False)
+        expires = request_deadline(message, started)
+        self.lock.acquire()
+        try:
+            if self.closed:
+                raise ConnectionClosed("The connection has been closed")
+            if not oneway:
+                self.next_id += 1
+                message["id"] = self.next_id
+                self.pending[message["id"]] = call
+        finally:
+            self.lock.release()
+        if message.get("stream"):
+            call.stream = Stream(self, message["id"], message["stream"],
+                                 expires)
+        try:
+            data, flags = compression.pack(self.compressor,
+                                           self.codec.encode(message))
+            self._send_frame(data, flags, expires)
+        except socket.error as e:
+            self._forget(message)
+            self.close()
+            raise ConnectionClosed(*e.args)
+        except Exception:
+            # The call failed, or was not sent in time.
+            self._forget(message)
+            raise
+        call.sent(len(data), started)
+        if oneway:
+            # No reply will come back, there is nothing to wait for.
+            metrics.client.record(call.method, False, 0, len(data),
+                                  **call.phases)
+            call.future.set_result(None)
+        else:
+            call.future.add_done_callback(
+                lambda future, call_id=message["id"]:
+                    self._cancelled(call_id, future))
+        return call.future
+
+    def close(self):
+        """Close the connection and fail the calls still waiting."""
+
+        self.lock.acquire()
+        try:
+            self.closed = True
+            pending, self.pending = self.pending, {}
+        finally:
+            self.lock.release()
+        try:
+            # Wake up the reader thread if it is waiting for a reply.
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        self.socket.close()
+        for call in pending.values():
+            call.fail(ConnectionClosed(
+                "The connection to {} was lost".format(self.address)))
+
+
+class LegacyConnection(object):
+    """Connection to a peer that only speaks the line protocol.
+
+    Such peers serve a single request per connection, so every request
+    opens a new one and waits for its reply.
 
     """
 
     def __init__(self, address):
-        self.address = tuple(address)
+        self.address = address
+        self.closed = False
 
-    def send(self, message):
+    def submit(self, message, connect=None):
+        started = time.perf_counter()
+        sock = transport.TCP.connect(self.address, message.get("deadline"))
         try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.connect(self.address)
-            message = message + "\n"
-            self.socket.send(message.encode())
-            result = self.socket.recv(1024)
+            call = PendingCall(message, time.perf_counter() - started)
+            started = time.perf_counter()
+            data = codec.JSON.encode(message) + b"\n"
+            sock.sendall(data)
+            call.sent(len(data), started)
+            reply = framing.Reader(sock).read_line()
         finally:
-            self.socket.close();
-        return result
+            sock.close()
+        if not reply:
+            call.fail(ConnectionClosed(
+                "The connection was closed by the peer"))
+        else:
+            call.finish(codec.JSON.decode(reply), len(reply))
+        return call.future
 
-    def _rmi(self, method, *args):
-        #
-        # Your code here.
-        #
+    def close(self):
+        pass
+
+
+class LoopbackConnection(object):
+    """Connection to a skeleton of this very process.
+
+    Requests are handed over to the skeleton, which runs them as it
+    runs those coming from the network. The request and the reply are
+    still serialized, and so copied, so that the caller and the callee
+    do not end up sharing objects.
+
+    """
+
+    def __init__(self, skeleton):
+        self.skeleton = skeleton
+        self.closed = False
+        self.codec = codec.codecs[0]
+
+    def _reply(self, call, reply):
+        if reply.cancelled():
+            return
         try:
-            message = json.dumps({"method":method,"args":args})
-            result = self.send(message)
-            output = json.loads(result.decode())
-            if "error" in output:
-                exception = type(output["error"]["name"], (Exception,), {})
-                raise exception(output["error"]["args"])
-            return output["result"]
+            data = encode_reply(reply.result(), self.codec)
+        except Exception as e:
+            call.fail(e)
+            return
+        call.finish(self.codec.decode(data), len(data))
+
+    def submit(self, message, connect=None):
+        started = time.perf_counter()
+        call = PendingCall(message, connect)
+        data = self.codec.encode(message)
+        call.sent(len(data), started)
+        oneway = message.get("oneway", False)
+        try:
+            reply = self.skeleton.call(self.codec.decode(data))
+        except OverloadError as e:
+            reply = None
+            if not oneway:
+                call.finish(error_reply(e), 0)
+                return call.future
+        if oneway:
+            metrics.client.record(call.method, False, 0, len(data),
+                                  **call.phases)
+            call.future.set_result(None)
+            return call.future
+        reply.add_done_callback(lambda reply: self._reply(call, reply))
+        call.future.add_done_callback(
+            lambda future: future.cancelled() and reply.cancel())
+        return call.future
+
+    def close(self):
+        pass
+
+
+# Skeletons of this process, by address, for the loopback connections.
+_skeletons = {}
+
+
+def register_skeleton(skeleton):
+    """Let the stubs of this process call skeleton directly."""
+
+    if transport.LOOPBACK:
+        _skeletons[tuple(skeleton.address)] = skeleton
+        _skeletons[skeleton.server.getsockname()] = skeleton
+
+
+class Channel(object):
+    """The connection shared by all the stubs of an address.
+
+    The connection is opened on first use and opened again if it is
+    lost. Addresses that refuse the handshake are remembered and spoken
+    to with the line protocol from then on. The channel also holds the
+    circuit breaker of the address.
+
+    """
+
+    def __init__(self, address):
+        self.address = address
+        self.lock = threading.Lock()
+        self.conn = None
+        self.breaker = breaker.CircuitBreaker(address, self._probe)
+
+    def connection(self, timeout=None):
+        """Return a (connection, fresh) pair for sending a request.
+
+        timeout bounds the time spent opening a new connection.
+
+        """
+
+        self.lock.acquire()
+        try:
+            if self.conn is not None and not self.conn.closed:
+                return self.conn, False
+            if self.address in _skeletons:
+                self.conn = LoopbackConnection(_skeletons[self.address])
+                return self.conn, True
+            conn = Connection(self.address, timeout)
+            if not conn.accepted:
+                # The server may have dropped the connection after
+                # refusing the handshake.
+                conn.close()
+                conn = LegacyConnection(self.address)
+            self.conn = conn
+            return conn, True
         finally:
+            self.lock.release()
+
+    def _send(self, message, expires):
+        while True:
+            started = time.perf_counter()
+            try:
+                conn, fresh = self.connection(time_left(expires))
+            except socket.timeout:
+                raise DeadlineExceeded(
+                    "Could not connect to {} in time".format(self.address))
+            connect = time.perf_counter() - started if fresh else None
+            try:
+                return conn.submit(message, connect)
+            except ConnectionClosed:
+                # The connection was lost while idle, so the request was
+                # never sent and can be sent again over a new one.
+                if fresh:
+                    raise
+            except socket.timeout:
+                raise DeadlineExceeded(
+                    "{} did not reply in time".format(self.address))
+
+    def _probe(self):
+        """Check that the peer answers, whatever it answers."""
+
+        expires = expiry(PROBE_TIMEOUT)
+        future = self._submit({"method": "check", "args": []}, expires)
+        try:
+            wait(future, expires)
+        except (ComunicationError, socket.error):
+            raise
+        except Exception:
+            # The peer does not know the method, but it is there.
             pass
-        
-    
+
+    def _outcome(self, future):
+        """Tell the breaker whether a call has reached the peer.
+
+        A call cancelled by its caller tells nothing about the peer,
+        unless it was cancelled because its deadline passed.
+
+        """
+
+        if future.cancelled():
+            if getattr(future, "expired", False):
+                self.breaker.failure()
+        elif peer_failed(future.exception()):
+            self.breaker.failure()
+        else:
+            self.breaker.success()
+
+    def _submit(self, message, expires):
+        if expires is not None:
+            message["deadline"] = time_left(expires)
+        span = tracing.client_span(method_name(message), self.address)
+        if span is None:
+            return self._send(message, expires)
+        message["trace"] = span.context()
+        try:
+            future = self._send(message, expires)
+        except Exception:
+            span.finish(error=True)
+            raise
+        future.add_done_callback(lambda future: span.finish(
+            future.cancelled() or future.exception() is not None))
+        return future
+
+    def submit(self, message, expires=None):
+        """Send a request and return the future of its result.
+
+        expires is the deadline of the call, as returned by expiry.
+        Raise PeerUnavailable if the breaker of the address is open.
+
+        """
+
+        if expires is not None and time_left(expires) <= 0:
+            raise DeadlineExceeded("The deadline passed before the call")
+        if not self.breaker.allow():
+            raise PeerUnavailable(
+                "{} is not available".format(self.address))
+        try:
+            future = self._submit(message, expires)
+        except Exception as e:
+            # Timing out while connecting also means the peer is gone.
+            if peer_failed(e) or isinstance(e, DeadlineExceeded):
+                self.breaker.failure()
+            raise
+        future.add_done_callback(self._outcome)
+        return future
+
+
+_channels = {}
+_channels_lock = threading.Lock()
+
+
+def get_channel(address):
+    """Return the channel shared by all the stubs of an address."""
+
+    address = tuple(address)
+    _channels_lock.acquire()
+    try:
+        if address not in _channels:
+            _channels[address] = Channel(address)
+        return _channels[address]
+    finally:
+        _channels_lock.release()
+
+
+class RemoteMethod(object):
+    """A method of a remote object, as returned by the attributes of a stub.
+
+    Calling it waits for the result. Its future method only sends the
+    request, so that several calls can be in flight at the same time,
+    its oneway method does not even ask for a reply, and its stream
+    method iterates over the result as the server produces it.
+
+    """
+
+    def __init__(self, stub, name):
+        self.stub = stub
+        self.name = name
+
+    def __call__(self, *args):
+        return self.stub._rmi(self.name, *args)
+
+    def future(self, *args):
+        """Start the call and return a concurrent.futures.Future.
+
+        The server gives up on the call once its deadline has passed,
+        but waiting for the future does not: pass a timeout to result
+        (or use wait) for that. Cancelling the future cancels the call.
+
+        """
+
+        return self.stub._rmi_async(self.name, *args)
+
+    def oneway(self, *args):
+        """Send the call and return as soon as it is sent.
+
+        The remote object runs the call but sends nothing back, so its
+        result and any error it raises are lost.
+
+        """
+
+        self.stub._rmi_oneway(self.name, *args)
+
+    def stream(self, *args):
+        """Make the call and return an iterator over its result.
+
+        If the method returns an iterator, its elements are sent one by
+        one as the remote object produces them, and the iterator is a
+        Stream. Any other result comes whole and is iterated over here.
+
+        """
+
+        return self.stub._rmi_stream(self.name, *args)
+
+
+class Stub(object):
+    """ Stub for generic objects distributed over the network.
+
+    This is  wrapper object for a socket. All the stubs of an address
+    share a single connection on which any number of calls can be in
+    flight at the same time.
+
+    Calls made through a stub with a timeout raise DeadlineExceeded if
+    they do not complete within timeout seconds. Calls made through a
+    stub with a retry policy are tried again if they could not reach
+    the peer and the policy says the method is idempotent.
+
+    """
+
+    def __init__(self, address, timeout=None, retry=None):
+        self.address = tuple(address)
+        self.timeout = timeout
+        self.retry = retry
+        self.channel = get_channel(self.address)
+
+    def _rmi_async(self, method, *args):
+        return self.channel.submit({"method": method, "args": args},
+                                   expiry(self.timeout))
+
+    def _retry_delay(self, method, error, attempt, expires):
+        """Return the time to wait before retrying a failed call.
+
+        Return None if the call must not be retried.
+
+        """
+
+        # Retrying is pointless once the breaker has opened.
+        if (self.retry is None or attempt >= self.retry.retries(method) or
+                not peer_failed(error) or isinstance(error, PeerUnavailable)):
+            return None
+        delay = self.retry.delay(attempt)
+        if expires is not None and delay >= time_left(expires):
+            return None
+        return delay
+
+    def _rmi(self, method, *args):
+        expires = expiry(self.timeout)
+        attempt = 0
+        while True:
+            try:
+                future = self.channel.submit({"method": method, "args": args},
+                                             expires)
+                return wait(future, expires)
+            except Exception as e:
+                delay = self._retry_delay(method, e, attempt, expires)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+
+    def _rmi_oneway(self, method, *args):
+        self.channel.submit({"method": method, "args": args, "oneway": True},
+                            expiry(self.timeout))
+
+    def _rmi_stream(self, method, *args):
+        expires = expiry(self.timeout)
+        future = self.channel.submit(
+            {"method": method, "args": args, "stream": STREAM_WINDOW}, expires)
+        result = wait(future, expires)
+        if isinstance(result, Stream):
+            return result
+        return iter(result)
+
     def __getattr__(self, attr):
         """Forward call to name over the network at the given address."""
-        def rmi_call(*args):
-            return self._rmi(attr, *args)
-        return rmi_call
+        return RemoteMethod(self, attr)
+
+
+def blocking(method):
+    """Mark method as one that may wait for other calls to be served.
+
+    Such are the methods that wait for a distributed lock, whose token
+    only comes with a call from another peer. Skeletons run the calls
+    to them in a pool of workers of their own, with its own queue:
+    enough of them waiting at once would otherwise take every worker,
+    leaving none to run the calls they wait for.
+
+    """
+
+    method.orb_blocking = True
+    return method
+
+
+def is_blocking(owner, message):
+    """Return whether a request calls a method of owner marked blocking."""
+
+    for call in message.get("batch", [message]):
+        try:
+            fn = getattr(owner, call["method"], None)
+        except Exception:
+            continue
+        if getattr(fn, "orb_blocking", False):
+            return True
+    return False
+
+
+def _run_future(future, fn, args):
+    if future.set_running_or_notify_cancel():
+        try:
+            future.set_result(fn(*args))
+        except Exception as e:
+            future.set_exception(e)
+
+
+class WorkerPool(object):
+    """Fixed number of threads running the requests of a skeleton.
+
+    Requests wait for a free worker in a bounded queue. When the queue
+    is full new requests are rejected at once with an OverloadError,
+    so that a burst of clients cannot make the server start an
+    unbounded number of threads. Calls to blocking methods are run by a
+    pool of their own (see blocking).
+
+    """
+
+    def __init__(self, workers=WORKERS, queue_size=QUEUE_SIZE):
+        self.queue = queue.Queue(queue_size)
+        self.lock = threading.Lock()
+        self.rejected = 0
+        self.threads = []
+        for i in range(workers):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def _work(self):
+        while True:
+            future, fn, args = self.queue.get()
+            _run_future(future, fn, args)
+
+    # Public methods
+
+    def submit(self, fn, *args):
+        """Queue fn(*args) and return the future of its result.
+
+        Raise OverloadError if the queue is full.
+
+        """
+
+        future = concurrent.futures.Future()
+        try:
+            self.queue.put_nowait((future, fn, args))
+        except queue.Full:
+            self.lock.acquire()
+            try:
+                self.rejected += 1
+            finally:
+                self.lock.release()
+            raise OverloadError("Too many requests are waiting to be served")
+        return future
+
+    def queue_depth(self):
+        """Return the number of requests waiting for a worker."""
+
+        return self.queue.qsize()
+
+
+class Batch(object):
+    """Several calls to a remote object sent as a single request.
+
+    Calls made on the batch are queued and sent together when the
+    with block ends (or when send is called). The remote object runs
+    them in order, and results then holds, for every call, either its
+    result or the exception it raised:
+
+        with orb.Batch(stub) as batch:
+            batch.read()
+            batch.write(fortune)
+        first, second = batch.results
+
+    """
+
+    def __init__(self, stub):
+        self.stub = stub
+        self.calls = []
+        self.results = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.send()
+
+    def __getattr__(self, attr):
+        """Queue a call to name, returning its index in the batch."""
+        def batch_call(*args):
+            self.calls.append({"method": attr, "args": args})
+            return len(self.calls) - 1
+        return batch_call
+
+    def send(self):
+        """Send the queued calls and return the list of their results."""
+
+        expires = expiry(self.stub.timeout)
+        replies = wait(self.stub.channel.submit({"batch": self.calls},
+                                                expires), expires)
+        self.calls = []
+        self.results = []
+        for reply in replies:
+            try:
+                self.results.append(unpack_reply(reply))
+            except Exception as e:
+                self.results.append(e)
+        return self.results
+
+
+def gather(stubs, method, *args):
+    """Call method on all the stubs at the same time.
+
+    stubs is a dictionary of stubs. Return a (results, errors) pair of
+    dictionaries holding, under the same keys, the result of every call
+    that succeeded and the exception raised by every call that failed.
+    The calls that the retry policies of their stubs allow to be retried
+    are made again together, after waiting for the longest of their
+    backoff delays.
+
+    """
+
+    expires = dict((key, expiry(stub.timeout)) for key, stub in stubs.items())
+    results = {}
+    errors = {}
+    pending = dict(stubs)
+    attempt = 0
+    while pending:
+        calls = {}
+        for key, stub in pending.items():
+            try:
+                calls[key] = stub.channel.submit(
+                    {"method": method, "args": args}, expires[key])
+            except Exception as e:
+                errors[key] = e
+        for key, call in calls.items():
+            try:
+                results[key] = wait(call, expires[key])
+                errors.pop(key, None)
+            except Exception as e:
+                errors[key] = e
+        delays = {}
+        for key in pending:
+            if key not in errors:
+                continue
+            delay = stubs[key]._retry_delay(method, errors[key], attempt,
+                                            expires[key])
+            if delay is not None:
+                delays[key] = delay
+        pending = dict((key, stubs[key]) for key in delays)
+        if pending:
+            time.sleep(max(delays.values()))
+        attempt += 1
+    return results, errors
+
+
+class StreamCredit(object):
+    """The number of elements of a stream that the client is ready for."""
+
+    def __init__(self, window):
+        self.available = window
+        self.cancelled = False
+        self.condition = threading.Condition()
+
+    def grant(self, count):
+        self.condition.acquire()
+        try:
+            self.available += count
+            self.condition.notify()
+        finally:
+            self.condition.release()
+
+    def cancel(self):
+        self.condition.acquire()
+        try:
+            self.cancelled = True
+            self.condition.notify()
+        finally:
+            self.condition.release()
+
+    def take(self, expires):
+        """Wait until one more element may be sent and account for it.
+
+        Return False if the stream has been cancelled. Raise
+        DeadlineExceeded if expires passes, or if the client asks for
+        nothing more for STREAM_IDLE_TIMEOUT seconds.
+
+        """
+
+        self.condition.acquire()
+        try:
+            while self.available <= 0 and not self.cancelled:
+                timeout = STREAM_IDLE_TIMEOUT
+                if expires is not None:
+                    timeout = min(timeout, time_left(expires))
+                if timeout <= 0 or not self.condition.wait(timeout):
+                    raise DeadlineExceeded(
+                        "The client did not ask for more of the stream")
+            if self.cancelled:
+                return False
+            if expires is not None and time_left(expires) <= 0:
+                raise DeadlineExceeded("The stream did not complete in time")
+            self.available -= 1
+            return True
+        finally:
+            self.condition.release()
 
 
 class Request(threading.Thread):
-    """Run the incoming requests on the owner object of the skeleton."""
+    """Run the incoming requests on the owner object of the skeleton.
+
+    Requests are handed over to the worker pool, or to the pool of the
+    blocking calls, and the replies to those sent as frames are sent
+    back as soon as they are ready. Every request served is accounted
+    for in the metrics registry of the skeleton. Framed requests still
+    waiting for a worker may be cancelled by the client, in which case
+    they are dropped without a reply.
 
-    def __init__(self, owner, conn, addr):
+    """
+
+    def __init__(self, owner, conn, addr, pool, registry, address,
+                 blocking_pool=None, stream_pool=None):
         threading.Thread.__init__(self)
         self.addr = addr
         self.conn = conn
         self.owner = owner
+        self.pool = pool
+        self.blocking_pool = blocking_pool or pool
+        self.stream_pool = stream_pool or pool
+        self.registry = registry
+        self.address = address
         self.daemon = True
+        self.send_lock = threading.Lock()
+        self.codec = codec.JSON
+        self.compressor = None
+        self.waiting_lock = threading.Lock()
+        self.waiting = set()
+        self.streams = {}
 
     # Tries to process the request, sends back an exception to the client if its raised.
-    def process_request(self, request):
+    def process_call(self, message):
         try:
-            message = json.loads(request)
             fn = getattr(self.owner, message["method"])
-            return json.dumps({"result" : fn(*message["args"])})
+            return result_reply(message, fn(*message["args"]))
         except Exception as e:
-            exec_name = e.__class__.__name__
-            exec_args = e.args
-            print(exec_name)
+            print(e.__class__.__name__)
             print(e)
-            result = json.dumps({"error": {"name": exec_name, "args": exec_args}})
-            return result
+            return error_reply(e)
+
+    def submit(self, message, fn, *args):
+        """Queue fn(*args) in the pool that runs message.
+
+        Return the future of its result. Raise OverloadError if the
+        queue of the pool is full.
+
+        """
+
+        if is_blocking(self.owner, message):
+            return self.blocking_pool.submit(fn, *args)
+        return self.pool.submit(fn, *args)
+
+    def process_request(self, message):
+        """Run a request, or all the calls of a batch in order."""
+
+        if "batch" in message:
+            return {"result": [self.process_call(call)
+                               for call in message["batch"]]}
+        return self.process_call(message)
+
+    def run_request(self, message, arrived):
+        """Run a request that arrived at the given time.
+
+        Return the reply together with the time the request waited for
+        a worker and the time it took to run. A request whose deadline
+        has passed is not run at all.
+
+        """
+
+        started = time.perf_counter()
+        expires = request_deadline(message, arrived)
+        if expires is not None and started >= expires:
+            reply = error_reply(DeadlineExceeded(
+                "The deadline passed before the call was run"))
+            return reply, {"queue": started - arrived}
+        span = tracing.server_span(method_name(message), self.address,
+                                   message.get("trace"))
+        token = tracing.activate(span)
+        deadline_token = current_deadline.set(expires)
+        try:
+            reply = self.process_request(message)
+        finally:
+            current_deadline.reset(deadline_token)
+            tracing.deactivate(token)
+        if span is not None:
+            span.finish("error" in reply)
+        return reply, {"queue": started - arrived,
+                       "exec": time.perf_counter() - started}
+
+    def handshake(self, request):
+        """Answer the handshake of a framing client.
+
+        Return False if the request is an ordinary one sent by a client
+        that only speaks the line protocol.
+
+        """
+
+        hello = parse_handshake(request)
+        if hello is None:
+            return False
+        self.codec = codec.choose(hello.get("codecs", []),
+                                  transport.is_trusted_peer(self.conn))
+        self.compressor = compression.choose(hello.get("compression"))
+        self.conn.sendall(handshake_message(
+            codec=self.codec.name,
+            compression=compression.name(self.compressor)))
+        return True
+
+    def serve_lines(self, reader, request):
+        """Serve requests sent one per line until the client leaves."""
+
+        while request:
+            arrived = time.perf_counter()
+            message = {"method": "<invalid>"}
+            phases = {}
+            try:
+                message = codec.JSON.decode(request)
+                reply, phases = self.submit(
+                    message, self.run_request, message, arrived).result()
+            except (ValueError, OverloadError) as e:
+                reply = error_reply(e)
+            data = encode_reply(reply) + b"\n"
+            self.conn.sendall(data)
+            self.registry.record(method_name(message), "error" in reply,
+                                 len(request), len(data), **phases)
+            request = reader.read_line()
+
+    def send_reply(self, message, reply):
+        """Send the reply to a framed request. Return its size."""
+
+        reply["id"] = message["id"]
+        data, flags = compression.pack(self.compressor,
+                                       encode_reply(reply, self.codec))
+        self.send_lock.acquire()
+        try:
+            framing.send_frame(self.conn, data, flags)
+        except socket.error:
+            # The caller is gone, there is no one to reply to.
+            pass
+        finally:
+            self.send_lock.release()
+        return len(data)
+
+    def send_stream(self, message, items, arrived):
+        """Send the elements of a streamed result, each in a frame.
+
+        Return the last reply sent, which ends the stream, and the size
+        of all the frames.
+
+        """
+
+        credit = StreamCredit(message["stream"])
+        self.waiting_lock.acquire()
+        try:
+            self.streams[message["id"]] = credit
+        finally:
+            self.waiting_lock.release()
+        expires = request_deadline(message, arrived)
+        bytes_out = 0
+        reply = {"end": True}
+        try:
+            for item in items:
+                if not credit.take(expires):
+                    # The client has closed the stream.
+                    return error_reply(ConnectionClosed(
+                        "The stream was closed by the client")), bytes_out
+                bytes_out += self.send_reply(message, {"item": item})
+        except Exception as e:
+            reply = error_reply(e)
+        finally:
+            self.waiting_lock.acquire()
+            try:
+                self.streams.pop(message["id"], None)
+            finally:
+                self.waiting_lock.release()
+            if hasattr(items, "close"):
+                items.close()
+        bytes_out += self.send_reply(message, reply)
+        return reply, bytes_out
+
+    def serve_local(self, message, arrived):
+        """Run a request made from this process and return its reply."""
+
+        reply, phases = self.run_request(message, arrived)
+        self.registry.record(method_name(message), "error" in reply,
+                             **phases)
+        return reply
+
+    def serve_call(self, message, bytes_in, arrived):
+        """Run a framed request and send its reply back, if any."""
+
+        if "id" in message:
+            self.waiting_lock.acquire()
+            try:
+                if message["id"] not in self.waiting:
+                    # The client has cancelled the call.
+                    self.registry.record(method_name(message), True,
+                                         bytes_in, 0)
+                    return
+                self.waiting.discard(message["id"])
+            finally:
+                self.waiting_lock.release()
+        reply, phases = self.run_request(message, arrived)
+        bytes_out = 0
+        if "stream" in reply and not message.get("oneway"):
+            # Waiting for the client to ask for more must not hold the
+            # worker of the call.
+            try:
+                self.stream_pool.submit(self.serve_stream, message,
+                                        reply["stream"], bytes_in, arrived,
+                                        phases)
+                return
+            except OverloadError as e:
+                if hasattr(reply["stream"], "close"):
+                    reply["stream"].close()
+                reply = error_reply(e)
+        if not message.get("oneway"):
+            bytes_out = self.send_reply(message, reply)
+        self.registry.record(method_name(message), "error" in reply,
+                             bytes_in, bytes_out, **phases)
+
+    def serve_stream(self, message, items, bytes_in, arrived, phases):
+        """Send a streamed result back, then account for the request."""
+
+        reply, bytes_out = self.send_stream(message, items, arrived)
+        self.registry.record(method_name(message), "error" in reply,
+                             bytes_in, bytes_out, **phases)
+
+    def serve_frames(self, reader):
+        """Serve requests sent as frames until the client leaves."""
+
+        while True:
+            request, flags = reader.read_frame()
+            if request is None:
+                break
+            arrived = time.perf_counter()
+            message = self.codec.decode(
+                compression.unpack(self.compressor, request, flags))
+            self.waiting_lock.acquire()
+            try:
+                if "cancel" in message:
+                    self.waiting.discard(message["cancel"])
+                    if message["cancel"] in self.streams:
+                        self.streams[message["cancel"]].cancel()
+                    continue
+                if "credit" in message:
+                    if message["credit"] in self.streams:
+                        self.streams[message["credit"]].grant(
+                            message["count"])
+                    continue
+                if "id" in message:
+                    self.waiting.add(message["id"])
+            finally:
+                self.waiting_lock.release()
+            try:
+                self.submit(message, self.serve_call, message, len(request),
+                            arrived)
+            except OverloadError as e:
+                self.waiting_lock.acquire()
+                try:
+                    self.waiting.discard(message.get("id"))
+                finally:
+                    self.waiting_lock.release()
+                bytes_out = 0
+                if not message.get("oneway"):
+                    bytes_out = self.send_reply(message, error_reply(e))
+                self.registry.record(method_name(message), True,
+                                     len(request), bytes_out)
 
     def run(self):
         try:
-            # Threat the socket as a file stream.
-            worker = self.conn.makefile(mode="rw")
-            # Read the request in a serialized form (JSON).
-            request = worker.readline()
-            # print(request)
-            # Process the request.
-            result = self.process_request(request)
-            # Send the result.
-            worker.write(result + '\n')
-            worker.flush()
+            reader = framing.Reader(self.conn)
+            # The first message is always a line: either the handshake of
+            # a framing client or the request of a line client.
+            request = reader.read_line()
+            if request and self.handshake(request):
+                self.serve_frames(reader)
+            else:
+                self.serve_lines(reader, request)
         except Exception as e:
             # Catch all errors in order to prevent the object from crashing
             # due to bad connections coming from outside.
             print("The connection to the caller has died:")
             print("\t{}: {}".format(type(e), e))
         finally:
+            self.waiting_lock.acquire()
+            try:
+                # No one is left to read the streams.
+                for credit in self.streams.values():
+                    credit.cancel()
+            finally:
+                self.waiting_lock.release()
             self.conn.close()
 
 
@@ -127,49 +1666,119 @@ class Skeleton(threading.Thread):
     """ Skeleton class for a generic owner.
 
     This is used to listen to an address of the network, manage incoming
-    connections and forward calls to the generic owner class.
+    connections and forward calls to the generic owner class. Calls are
+    run by a fixed pool of workers, those to blocking methods by a pool
+    of blocking_workers (see WorkerPool and blocking), and streamed
+    results are sent by a pool of stream_workers. The skeleton listens
+    on every transport in use (see the transport module), and takes the
+    calls of the stubs of its own process directly.
+
+    With reuse_port, the skeletons of several processes can listen to
+    the same TCP port (and to TCP only), the connections being spread
+    among them by the kernel. This lets a server use more than one core
+    for calls that do not need to see each other's writes.
 
     """
 
-    def __init__(self, owner, address):
+    def __init__(self, owner, address, workers=WORKERS,
+                 queue_size=QUEUE_SIZE, backlog=BACKLOG, reuse_port=False,
+                 blocking_workers=BLOCKING_WORKERS,
+                 stream_workers=STREAM_WORKERS):
         threading.Thread.__init__(self)
         self.address = address
         self.owner = owner
         self.daemon = True
+        self.pool = WorkerPool(workers, queue_size)
+        self.blocking_pool = WorkerPool(blocking_workers, queue_size)
+        self.stream_pool = WorkerPool(stream_workers, queue_size)
+        self.metrics = metrics.Registry()
         #
         # Your code here.
         #
-        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self.server.bind(self.address)
-        self.server.listen(1)
+        self.servers = transport.listen(self.address, backlog, reuse_port)
+        self.server = self.servers[0]
+        if self.address[1] == 0:
+            # Known by the port picked by the system from now on.
+            self.address = (address[0], self.server.getsockname()[1])
+        # Runs the calls made from this process.
+        self.local = Request(owner, None, None, self.pool, self.metrics,
+                             self.address, self.blocking_pool)
+        register_skeleton(self)
+
+    def _accept(self, server):
+        while True:
+            try:
+                conn, addr = server.accept()
+                transport.prepare(conn)
+                req = Request(self.owner, conn, addr, self.pool,
+                              self.metrics, self.address, self.blocking_pool,
+                              self.stream_pool)
+                # print("\n" + "Serving a request from {0}".format(addr))
+                req.start()
+            except socket.error:
+                continue
+
+    def call(self, message):
+        """Run a request made from this process.
+
+        Return the future of its reply. Raise OverloadError if too many
+        requests are waiting already.
 
+        """
+
+        return self.local.submit(message, self.local.serve_local, message,
+                                 time.perf_counter())
+
+    def queue_depth(self):
+        """Return the number of requests waiting for a worker."""
+
+        return (self.pool.queue_depth() + self.blocking_pool.queue_depth() +
+                self.stream_pool.queue_depth())
+
+    def rejected(self):
+        """Return the number of requests refused because of overload."""
+
+        return (self.pool.rejected + self.blocking_pool.rejected +
+                self.stream_pool.rejected)
 
     def run(self):
         #
         # Your code here.
         #
+        for server in self.servers[1:]:
+            thread = threading.Thread(target=self._accept, args=(server,))
+            thread.daemon = True
+            thread.start()
         try:
-            while True:
-                try:
-                    conn, addr = self.server.accept()
-                    req = Request(self.owner, conn, addr)
-                    # print("\n" + "Serving a request from {0}".format(addr))
-                    req.start()
-                except socket.error:
-                    continue
+            self._accept(self.server)
         except KeyboardInterrupt:
             pass
 
 
+def make_skeleton(owner, address, runtime=None):
+    """Create the skeleton of owner for the given runtime."""
+
+    runtime = runtime or RUNTIME
+    if runtime == "threads":
+        return Skeleton(owner, address)
+    elif runtime == "asyncio":
+        from . import asyncOrb
+        return asyncOrb.AsyncSkeleton(owner, address)
+    raise ValueError("Unknown runtime: '{}'".format(runtime))
+
+
 class Peer:
     """Class, extended by objects that communicate over the network."""
 
-    def __init__(self, l_address, ns_address, ptype):
+    def __init__(self, l_address, ns_address, ptype, runtime=None):
         self.type = ptype
         self.hash = ""
         self.id = -1
+        if ns_address[0] != "":
+            # Look the name service up while the skeleton binds.
+            resolver.prefetch(ns_address[0])
         self.address = self._get_external_interface(l_address)
-        self.skeleton = Skeleton(self, self.address)
+        self.skeleton = make_skeleton(self, self.address, runtime)
         self.name_service_address = self._get_external_interface(ns_address)
         self.name_service = Stub(self.name_service_address)
 
@@ -179,13 +1788,14 @@ class Peer:
         """ Determine the external interface associated with a host name.
 
         This function translates the machine's host name into its the
-        machine's external address, not into '127.0.0.1'.
+        machine's external address, not into '127.0.0.1'. Host names are
+        looked up through the resolver cache of the process.
 
         """
 
         addr_name = address[0]
         if addr_name != "":
-            addrs = socket.gethostbyname_ex(addr_name)[2]
+            addrs = resolver.resolve(addr_name)
             if len(addrs) == 0:
                 raise ComunicationError("Invalid address to listen to")
             elif len(addrs) == 1:
@@ -210,6 +1820,21 @@ class Peer:
         """Unregister the object before removal."""
 
         self.name_service.unregister(self.id, self.type, self.hash)
+        metrics.dump(self.stats())
+
+    def stats(self):
+        """Return the metrics of the calls served and made by this peer."""
+
+        server = self.skeleton.metrics.snapshot()
+        server["queue_depth"] = self.skeleton.queue_depth()
+        server["rejected"] = self.skeleton.rejected()
+        return {
+            "id": self.id,
+            "type": self.type,
+            "address": self.address,
+            "server": server,
+            "client": metrics.client.snapshot()
+        }
 
     def check(self):
         """Checking to see if the object is still alive."""
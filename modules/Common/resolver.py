@@ -0,0 +1,139 @@
+# -----------------------------------------------------------------------------
+# Distributed Systems (TDDD25)
+# -----------------------------------------------------------------------------
+# Author: Sergiu Rafiliu (sergiu.rafiliu@liu.se)
+# Modified: 31 July 2013
+#
+# Copyright 2012 Linkoping University
+# -----------------------------------------------------------------------------
+
+"""Cached resolution of host names, shared by the whole process.
+
+The addresses of a host name are looked up once and kept for TTL
+seconds, so the peers and stubs of a process that name the same hosts
+do not query the resolver of the system again and again. Threads that
+ask for a name being looked up already wait for that lookup instead of
+starting their own, and prefetch starts a lookup in the background, to
+be picked up later by resolve.
+
+Host names can be given fixed addresses, either with override or with
+the ORB_HOSTS environment variable, e.g. ORB_HOSTS=ns=10.0.0.1,db=10.0.0.2.
+
+"""
+
+import concurrent.futures
+import os
+import socket
+import threading
+import time
+
+# Seconds for which the addresses of a host name are kept.
+TTL = float(os.environ.get("ORB_RESOLVER_TTL", 300))
+
+_lock = threading.Lock()
+# The addresses of every host name looked up, with the time they expire.
+_cache = {}
+# The futures of the lookups going on.
+_pending = {}
+_overrides = {}
+
+
+def _lookup(host, future):
+    try:
+        addresses = socket.gethostbyname_ex(host)[2]
+    except Exception as e:
+        _lock.acquire()
+        try:
+            _pending.pop(host, None)
+        finally:
+            _lock.release()
+        future.set_exception(e)
+        return
+    _lock.acquire()
+    try:
+        _cache[host] = (addresses, time.monotonic() + TTL)
+        _pending.pop(host, None)
+    finally:
+        _lock.release()
+    future.set_result(addresses)
+
+
+def _start(host):
+    """Return the future of the addresses of host, and whether it is new.
+
+    A new future is not being looked up yet; the caller must do it.
+
+    """
+
+    _lock.acquire()
+    try:
+        future = concurrent.futures.Future()
+        if host in _overrides:
+            future.set_result([_overrides[host]])
+            return future, False
+        if host in _cache and _cache[host][1] > time.monotonic():
+            future.set_result(_cache[host][0])
+            return future, False
+        if host in _pending:
+            return _pending[host], False
+        _pending[host] = future
+        return future, True
+    finally:
+        _lock.release()
+
+
+def resolve(host, timeout=None):
+    """Return the IPv4 addresses of host.
+
+    Raise socket.gaierror if host is unknown. Failures are not cached.
+
+    """
+
+    future, new = _start(host)
+    if new:
+        _lookup(host, future)
+    return future.result(timeout)
+
+
+def prefetch(host):
+    """Start looking host up in the background.
+
+    Return the future of its addresses.
+
+    """
+
+    future, new = _start(host)
+    if new:
+        thread = threading.Thread(target=_lookup, args=(host, future))
+        thread.daemon = True
+        thread.start()
+    return future
+
+
+def override(host, address):
+    """Make host resolve to address, or to what the system says if None."""
+
+    _lock.acquire()
+    try:
+        if address is None:
+            _overrides.pop(host, None)
+        else:
+            _overrides[host] = address
+        _cache.pop(host, None)
+    finally:
+        _lock.release()
+
+
+def clear():
+    """Forget all the addresses looked up so far."""
+
+    _lock.acquire()
+    try:
+        _cache.clear()
+    finally:
+        _lock.release()
+
+
+for entry in os.environ.get("ORB_HOSTS", "").split(","):
+    if "=" in entry:
+        override(*entry.split("=", 1))
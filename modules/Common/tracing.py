@@ -0,0 +1,182 @@
+# -----------------------------------------------------------------------------
+# Distributed Systems (TDDD25)
+# -----------------------------------------------------------------------------
+# Author: Sergiu Rafiliu (sergiu.rafiliu@liu.se)
+# Modified: 31 July 2013
+#
+# Copyright 2012 Linkoping University
+# -----------------------------------------------------------------------------
+
+"""Distributed tracing of the calls made through the Object Request Broker.
+
+Every remote call is a client span on the caller and a server span on
+the callee. A message carries the trace id and the id of the client
+span in its "trace" field, and the server span is made a child of it.
+While a method runs, its server span is the current span, so the calls
+it makes in turn become its children. A write on a replica thus yields
+a single trace holding the request_token, obtain_token and
+write_no_lock calls it caused, on every peer they reached.
+
+Spans are recorded when tracing is enabled, either by setting the
+ORB_TRACE_FILE environment variable or by calling enable. Each span is
+then written as a line of JSON to that file; the files written by
+several peers can be put together with merge:
+
+    python3 tracing.py merged.jsonl peer1.jsonl peer2.jsonl ...
+
+Trace contexts are passed on even when tracing is disabled, so a peer
+that records spans still sees the whole call chain.
+
+"""
+
+import collections
+import contextvars
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+
+# The span of the method being run, as a [trace id, span id] pair.
+current = contextvars.ContextVar("current_span", default=None)
+
+# The spans recorded last, in memory.
+spans = collections.deque(maxlen=10000)
+
+_lock = threading.Lock()
+_file = None
+enabled = False
+
+
+def _new_id():
+    return "{:016x}".format(random.getrandbits(64))
+
+
+class Span(object):
+    """A timed step of a trace: one side of one remote call."""
+
+    def __init__(self, name, kind, address, parent=None):
+        if parent is None:
+            self.trace, self.parent = _new_id(), None
+        else:
+            self.trace, self.parent = parent
+        self.id = _new_id()
+        self.name = name
+        self.kind = kind
+        self.address = address
+        self.start = time.time()
+        self.end = None
+        self.error = False
+
+    def context(self):
+        """Return the context that a message carries for this span."""
+
+        return [self.trace, self.id]
+
+    def finish(self, error=False):
+        """Close the span and record it if tracing is enabled."""
+
+        self.end = time.time()
+        self.error = bool(error)
+        if enabled:
+            _record(self)
+
+    def to_dict(self):
+        return {
+            "trace": self.trace,
+            "span": self.id,
+            "parent": self.parent,
+            "name": self.name,
+            "kind": self.kind,
+            "address": list(self.address) if self.address else None,
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "start": self.start,
+            "end": self.end,
+            "duration": self.end - self.start,
+            "error": self.error
+        }
+
+
+def _record(span):
+    record = span.to_dict()
+    _lock.acquire()
+    try:
+        spans.append(record)
+        if _file is not None:
+            _file.write(json.dumps(record) + "\n")
+            _file.flush()
+    finally:
+        _lock.release()
+
+
+def enable(path=None):
+    """Start recording spans, writing them to path if it is given."""
+
+    global enabled, _file
+    _lock.acquire()
+    try:
+        if _file is not None:
+            _file.close()
+        _file = open(path, "a") if path else None
+        enabled = True
+    finally:
+        _lock.release()
+
+
+def client_span(name, address):
+    """Start the span of an outgoing call.
+
+    Return None when tracing is disabled and no trace is going on, in
+    which case the call carries no trace context.
+
+    """
+
+    parent = current.get()
+    if parent is None and not enabled:
+        return None
+    return Span(name, "client", address, parent)
+
+
+def server_span(name, address, context):
+    """Start the span of an incoming call, given the context it carries."""
+
+    if context is None and not enabled:
+        return None
+    return Span(name, "server", address, context)
+
+
+def activate(span):
+    """Make span the current span. Return a token for deactivate."""
+
+    return current.set(span.context() if span is not None else None)
+
+
+def deactivate(token):
+    current.reset(token)
+
+
+def merge(paths, out_path):
+    """Put together the trace files of several peers, ordered by trace."""
+
+    records = []
+    for path in paths:
+        with open(path) as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+    records.sort(key=lambda record: (record["trace"], record["start"]))
+    with open(out_path, "w") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+if os.environ.get("ORB_TRACE_FILE"):
+    enable(os.environ["ORB_TRACE_FILE"])
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print("Usage: {} OUTPUT TRACE_FILE...".format(sys.argv[0]))
+        sys.exit(1)
+    merge(sys.argv[2:], sys.argv[1])
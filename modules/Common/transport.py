@@ -0,0 +1,262 @@
+# -----------------------------------------------------------------------------
+# Distributed Systems (TDDD25)
+# -----------------------------------------------------------------------------
+# Author: Sergiu Rafiliu (sergiu.rafiliu@liu.se)
+# Modified: 31 July 2013
+#
+# Copyright 2012 Linkoping University
+# -----------------------------------------------------------------------------
+
+"""Transports carrying the connections of the Object Request Broker.
+
+Peers are always known by a TCP address, but a skeleton listens on
+every transport available, and a stub connects with the first one that
+reaches the address:
+
+--  UnixTransport ::
+        A Unix domain socket whose path is derived from the TCP address.
+        It is only tried for addresses of this host, and spares the
+        messages the TCP/IP stack. The sockets lie in a directory only
+        their user may enter, and a stub only uses a socket whose
+        skeleton runs as the same user.
+--  TcpTransport ::
+        The TCP address itself. It works everywhere.
+
+Which transports are used, and in what order, is given by the
+ORB_TRANSPORTS environment variable (by default "unix,tcp"). Peers in
+the same process skip the transports altogether and call each other
+through orb.LoopbackConnection, unless ORB_LOOPBACK is set to "0".
+
+"""
+
+import atexit
+import os
+import socket
+import stat
+import struct
+import tempfile
+import threading
+
+from . import resolver
+
+# Directory holding the Unix domain sockets of the skeletons, private to
+# the user.
+SOCKET_DIR = os.environ.get("ORB_SOCKET_DIR") or os.path.join(
+    os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir(),
+    "orb-{}".format(os.getuid()))
+
+# Whether the peers of a process call each other directly.
+LOOPBACK = os.environ.get("ORB_LOOPBACK", "1") != "0"
+
+_local_lock = threading.Lock()
+_local = {}
+
+
+def is_local(host):
+    """Return True if host is an address of this machine."""
+
+    _local_lock.acquire()
+    try:
+        if host not in _local:
+            # Only the addresses of this machine can be bound to.
+            probe = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                probe.bind((host, 0))
+                _local[host] = True
+            except (socket.error, OverflowError):
+                _local[host] = False
+            finally:
+                probe.close()
+        return _local[host]
+    finally:
+        _local_lock.release()
+
+
+def is_trusted_peer(sock):
+    """Return True if the peer of a connected socket runs as this user.
+
+    Only the peers of Unix domain sockets can be told. Where the system
+    does not tell their user, they are trusted, as only this user can
+    reach the directory of the sockets.
+
+    """
+
+    if sock.family != getattr(socket, "AF_UNIX", None):
+        return False
+    return peer_uid(sock) in (None, os.getuid())
+
+
+def peer_uid(sock):
+    """Return the user id of the peer of a Unix domain socket.
+
+    Return None if the system does not tell.
+
+    """
+
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+    credentials = struct.Struct("3i")
+    pid, uid, gid = credentials.unpack(sock.getsockopt(
+        socket.SOL_SOCKET, socket.SO_PEERCRED, credentials.size))
+    return uid
+
+
+def prepare(sock):
+    """Set up a newly connected socket, whatever its transport."""
+
+    if isinstance(sock, socket.socket) and sock.family == socket.AF_INET:
+        # Replies are small and must not wait for the previous ones to
+        # be acknowledged.
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+class TcpTransport(object):
+    """Connections over TCP."""
+
+    name = "tcp"
+
+    def listen(self, address, backlog, reuse_port=False):
+        server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        if reuse_port:
+            # Several processes listen to the same port and the kernel
+            # spreads the connections among them.
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        server.bind(address)
+        server.listen(backlog)
+        return server
+
+    def connect(self, address, timeout=None):
+        host = address[0]
+        if host:
+            # Host names are looked up once for the whole process.
+            host = resolver.resolve(host)[0]
+        return prepare(socket.create_connection((host, address[1]), timeout))
+
+
+class UnixTransport(object):
+    """Connections over Unix domain sockets, for peers of the same host."""
+
+    name = "unix"
+
+    def path(self, address):
+        """Return the path of the socket of the skeleton at address."""
+
+        return os.path.join(SOCKET_DIR, "orb-{}-{}.sock".format(*address))
+
+    def _private_dir(self):
+        """Return True if SOCKET_DIR is a directory only the user can use.
+
+        Make it if it does not exist.
+
+        """
+
+        try:
+            os.makedirs(SOCKET_DIR, 0o700, exist_ok=True)
+            info = os.lstat(SOCKET_DIR)
+        except OSError:
+            return False
+        return (stat.S_ISDIR(info.st_mode) and info.st_uid == os.getuid()
+                and not info.st_mode & 0o077)
+
+    def listen(self, address, backlog):
+        if not hasattr(socket, "AF_UNIX") or not self._private_dir():
+            # Left to TCP.
+            return None
+        path = self.path(address)
+        if os.path.exists(path):
+            # Left behind by a skeleton that is gone, as the TCP address
+            # could not have been bound to otherwise.
+            os.unlink(path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(path)
+        server.listen(backlog)
+        atexit.register(self._unlink, path, os.getpid())
+        return server
+
+    def _unlink(self, path, pid):
+        # Forked children must leave the socket of their parent alone.
+        if os.getpid() == pid and os.path.exists(path):
+            os.unlink(path)
+
+    def connect(self, address, timeout=None):
+        if not hasattr(socket, "AF_UNIX") or not is_local(address[0]):
+            return None
+        path = self.path(address)
+        if not os.path.exists(path):
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(path)
+            uid = peer_uid(sock)
+        except socket.error:
+            # The skeleton is gone; the TCP address tells whether it is.
+            sock.close()
+            return None
+        if uid is not None and uid != os.getuid():
+            # Not a skeleton of this user, whatever it claims.
+            sock.close()
+            return None
+        return sock
+
+
+TCP = TcpTransport()
+UNIX = UnixTransport()
+
+_known = dict((transport.name, transport) for transport in [UNIX, TCP])
+
+# Transports in use, the preferred ones first.
+transports = [_known[name] for name
+              in os.environ.get("ORB_TRANSPORTS", "unix,tcp").split(",")
+              if name in _known]
+
+
+def register(transport, preferred=True):
+    """Make a transport available, before or after the ones known so far."""
+
+    _known[transport.name] = transport
+    if preferred:
+        transports.insert(0, transport)
+    else:
+        transports.append(transport)
+
+
+def connect(address, timeout=None):
+    """Return a socket connected to address by the first transport that can.
+
+    TCP is always tried last, even if it is not in use otherwise.
+
+    """
+
+    for transport in transports:
+        if transport is TCP:
+            continue
+        sock = transport.connect(address, timeout)
+        if sock is not None:
+            return sock
+    return TCP.connect(address, timeout)
+
+
+def listen(address, backlog, reuse_port=False):
+    """Listen on address with all the transports in use.
+
+    Return the listening sockets, the TCP one first. Its address is the
+    one the other transports are derived from when the port of address
+    is 0. With reuse_port, other processes may listen to the same TCP
+    address; only TCP is then used, as the other transports cannot be
+    shared that way.
+
+    """
+
+    server = TCP.listen(address, backlog, reuse_port)
+    if reuse_port:
+        return [server]
+    address = server.getsockname()
+    servers = [server]
+    for transport in transports:
+        if transport is not TCP:
+            sock = transport.listen(address, backlog)
+            if sock is not None:
+                servers.append(sock)
+    return servers
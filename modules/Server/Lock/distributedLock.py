@@ -28,6 +28,8 @@ The implementation should satisfy the following requests:
 
 """
 
+from Common import orb
+
 NO_TOKEN = 0
 TOKEN_PRESENT = 1
 TOKEN_HELD = 2
@@ -58,20 +60,31 @@ class DistributedLock(object):
         self.token = {}
         self.request = {}
         self.state = NO_TOKEN
+        # Whether a thread of this peer holds the lock or is waiting for
+        # the token; the others wait for it to release the lock first.
+        self.busy = False
 
-    def _prepare(self, token):
-        """Prepare the token to be sent as a JSON message.
+    def _unprepare(self, token):
+        """Return a received token as a dictionary with integer keys.
 
-        This step is necessary because in the JSON standard, the key to
-        a dictionary must be a string whild in the token the key is
-        integer.
+        Peers normally agree on a codec that sends the token as it is.
+        Only if they fell back to JSON, where the key to a dictionary
+        must be a string, do the keys need to be turned back into
+        integers.
         """
 
-        return list(token.items())
+        if token and isinstance(next(iter(token)), str):
+            return dict((int(pid), time) for pid, time in token.items())
+        return token
 
-    def _unprepare(self, token):
-        """The reverse operation to the one above."""
-        return dict(token)
+    def _wait(self, predicate, expires):
+        """Wait on the condition of peer_list until predicate is true."""
+
+        while not predicate():
+            if expires is not None and orb.time_left(expires) == 0:
+                raise orb.DeadlineExceeded(
+                    "The deadline passed while waiting for the lock")
+            self.peer_list.lock.wait(orb.time_left(expires))
 
     # Public methods
 
@@ -139,7 +152,7 @@ class DistributedLock(object):
                 if(self.state == TOKEN_PRESENT):
                 # Unless we are the last peer that is still alive
                     if(peers):
-                        peers[min(peers.keys())].obtain_token(self._prepare(self.token))
+                        peers[min(peers.keys())].obtain_token(self.token)
         finally:
             self.peer_list.lock.release()
 
@@ -163,32 +176,60 @@ class DistributedLock(object):
         if pid in self.request:
             del self.request[pid]
 
+    @orb.blocking
     def acquire(self):
-        """Called when this object tries to acquire the lock."""
+        """Called when this object tries to acquire the lock.
+
+        Wait on the condition of peer_list until the token comes, and
+        raise orb.DeadlineExceeded if the deadline of the call being
+        served passes first.
+
+        """
         print("Trying to acquire the lock...")
         #
         # Your code here.
         #
-        
-        if(self.state == NO_TOKEN):
-            peers = self.peer_list.get_peers()
-            self.peer_list.lock.acquire()
+        expires = orb.current_deadline.get()
+        condition = self.peer_list.lock
+        condition.acquire()
+        try:
+            # The threads of this peer take turns.
+            self._wait(lambda: not self.busy, expires)
+            self.busy = True
+            requested = self.state == NO_TOKEN
+            time = self.time
+        finally:
+            condition.release()
+
+        try:
+            if requested:
+                # Adds the aquire request to all other peers at once,
+                # skipping the ones that are dead. Not under the lock,
+                # which their requests for the token need.
+                results, errors = self.peer_list.gather(
+                    "request_token", time, self.owner.id,
+                    pids=self.peer_list.available())
+                for error in errors.values():
+                    if not orb.peer_failed(error):
+                        raise error
+            condition.acquire()
             try:
-                # Adds the aquire request to all other peers
-                for pid in peers:
-                    print(pid)
-                    self.peer_list.peer(pid).request_token(self.time, self.owner.id)
-            # peer.request_token(self.time, self.owner.id)
+                self._wait(lambda: self.state != NO_TOKEN, expires)
+                # Declares that Im holding the token
+                self.state = TOKEN_HELD
             finally:
-                self.peer_list.lock.release()
-
-
-            # Busy wait to aquire the token
-            while(self.state != TOKEN_PRESENT):
-                pass
-        
-        # Declares that Im holding the token
-        self.state = TOKEN_HELD
+                condition.release()
+        except BaseException:
+            condition.acquire()
+            try:
+                self.busy = False
+                if self.state == TOKEN_PRESENT:
+                    # Requests that came meanwhile were left to us.
+                    self.release_no_lock()
+                condition.notify_all()
+            finally:
+                condition.release()
+            raise
 
     def release(self):
         self.peer_list.lock.acquire()
@@ -207,6 +248,9 @@ class DistributedLock(object):
         #
         peers = self.peer_list.get_peers()
         self.state = TOKEN_PRESENT
+        self.busy = False
+        # Let the next thread of this peer have a go.
+        self.peer_list.lock.notify_all()
         # WHY?
         self.time  += 1
 
@@ -215,10 +259,20 @@ class DistributedLock(object):
         smaller_pids = [key for key in peers.keys() if key < self.owner.id]
 
         for k in (larger_pids + smaller_pids):
-            if(self.request[k] > self.token[k]):
-                self.state = NO_TOKEN
+            # Dead peers are skipped, they could not take the token.
+            if not self.peer_list.is_available(k):
+                continue
+            if(self.request.get(k, 0) > self.token.get(k, 0)):
                 self.token[self.owner.id] = self.time
-                self.peer_list.peer(k).obtain_token(self._prepare(self.token))
+                # Hand the token over without waiting for the receiver
+                # to process it.
+                try:
+                    self.peer_list.peer(k).obtain_token.oneway(self.token)
+                except Exception as e:
+                    if not orb.peer_failed(e):
+                        raise
+                    continue
+                self.state = NO_TOKEN
                 break
 
 
@@ -233,7 +287,8 @@ class DistributedLock(object):
         try:
             t = max(self.time, time)
             self.request[pid] = t + 1
-            if(self.state == TOKEN_PRESENT):
+            # A thread of this peer waiting for the token takes it first.
+            if(self.state == TOKEN_PRESENT and not self.busy):
                 self.release_no_lock()
         finally:
             self.peer_list.lock.release()
@@ -245,8 +300,16 @@ class DistributedLock(object):
         # Your code here.
         #
         # Recieves the token
-        self.token = self._unprepare(token)
-        self.state = TOKEN_PRESENT
+        self.peer_list.lock.acquire()
+        try:
+            self.token = self._unprepare(token)
+            self.state = TOKEN_PRESENT
+            if not self.busy:
+                # No one here wants it any more: pass it on, if asked.
+                self.release_no_lock()
+            self.peer_list.lock.notify_all()
+        finally:
+            self.peer_list.lock.release()
 
 
     def display_status(self):
@@ -11,29 +11,35 @@
 
 import random
 
+from Server import fortuneStore
+from Server import writeLog
+
 
 class Database(object):
     """Class containing a database implementation."""
 
-    def __init__(self, db_file):
+    def __init__(self, db_file, storage="list"):
+        """Open the database of db_file.
+
+        storage is the name of the fortuneStore store holding the
+        fortunes: "list" keeps them all in memory as str, "compact" as
+        bytes in a single buffer, and "mmap" maps the file. The last two
+        only decode the fortunes that are read.
+
+        """
+
         self.db_file = db_file
         self.rand = random.Random()
         self.rand.seed()
         #
         # Your code here.
         #
-        read_line = "";
-        self.database = []
         # Read database from file
-        with open(self.db_file) as f:
-            for line in f:
-                if(line == "%\n"):
-                    self.database.append(read_line)
-                    read_line = ""
-                else:
-                    read_line += line;
-                    
-        
+        self.database = fortuneStore.STORES[storage](self.db_file)
+        # Fortunes are appended to the file by the writer thread of the
+        # log, and added to the store once they are in it.
+        self.log = writeLog.WriteLog(self.db_file, self._written)
+
         print(len(self.database));
 
     def read(self):
@@ -45,19 +51,61 @@ class Database(object):
             
         return random.choice(self.database)
 
+    def read_many(self, n):
+        """Read n random locations in the database."""
 
-    def write(self, fortune):
-        """Write a new fortune to the database."""
+        return random.choices(self.database, k=n)
+
+
+    def write(self, fortune, durability=writeLog.OS):
+        """Write a new fortune to the database.
+
+        durability is writeLog.NONE, OS or FSYNC: how far the fortune
+        must have gone towards the disk before returning. Concurrent
+        writes are written to the file together.
+
+        """
         #
         # Your code here.
         #
-        
-        # Append to database
+
+        # Append to files, and to database once it is in the file the
+        # mmap store reads it from.
+        self.log.append((fortune + "\n%\n").encode("utf-8"), durability,
+                        [fortune])
+
+    def write_many(self, fortunes, durability=writeLog.OS):
+        """Write new fortunes to the database, with a single append."""
+
+        if not fortunes:
+            return
+        data = "".join(fortune + "\n%\n" for fortune in fortunes)
+        self.log.append(data.encode("utf-8"), durability, fortunes)
+
+    def _written(self, fortunes):
+        """Add the fortunes the log has just written to the file."""
+
+        for fortune in fortunes:
+            self.database.append(fortune)
+
+    def add(self, fortune):
+        """Add a fortune that another process has written to the file."""
+
         self.database.append(fortune)
 
-        # Append to files
-        with open(self.db_file, "a") as myfile:
-            myfile.write(fortune + "\n%\n")
+    def stream(self, start=0, stop=None):
+        """Return an iterator over the fortunes from start up to stop.
+
+        Fortunes are only ever appended, so the iterator goes over the
+        fortunes the database held when it was called, even while new
+        ones are written. Remotely, it is sent to the caller one fortune
+        at a time (see orb.Stream).
+
+        """
+
+        size = len(self.database)
+        stop = size if stop is None else min(stop, size)
+        return (self.database[i] for i in range(start, stop))
 
             
 
@@ -0,0 +1,423 @@
+# -----------------------------------------------------------------------------
+# Distributed Systems (TDDD25)
+# -----------------------------------------------------------------------------
+# Author: Sergiu Rafiliu (sergiu.rafiliu@liu.se)
+# Modified: 24 July 2013
+#
+# Copyright 2012 Linkoping University
+# -----------------------------------------------------------------------------
+
+"""Storage of the fortunes of a database file.
+
+A fortune file holds fortunes separated by lines holding only "%". A
+store gives access to them by position, like a list, and is told about
+the fortunes appended to the file with append:
+
+--  ListStore ::
+        Reads the whole file at once and keeps every fortune in memory
+        as a str.
+--  CompactStore ::
+        Reads the whole file at once into a single buffer, next to an
+        array of the offsets at which the fortunes start, and decodes
+        the fortunes when they are asked for. Its memory holds little
+        more than the bytes of the fortunes, and it is cheap to pickle
+        or to share with processes forked from this one (see snapshot).
+--  MmapStore ::
+        Maps the file into memory and keeps only an array of the
+        offsets at which the fortunes start. A fortune is only decoded
+        when it is asked for, so a store opens quickly and takes little
+        memory however large the file is, and the processes using the
+        same file share its pages.
+
+        The offsets are kept in an index file next to the fortune file,
+        so that the next store opening the file only has to look at the
+        fortunes appended since. The index is checked against the file
+        when it is read, and built anew if either has been changed other
+        than by appending to the file. The check looks at the identity
+        of the file, the checksum of the end of the part it covers and
+        of the offsets themselves, and a sample of the offsets, so that
+        it does not read the whole file. With verify, the checksum of
+        the whole part is checked as well.
+
+"""
+
+import array
+import functools
+import itertools
+import mmap
+import operator
+import os
+import struct
+import sys
+import threading
+import zlib
+
+SEPARATOR = b"%\n"
+
+# Bytes of the file split into fortunes at a time.
+SCAN_SIZE = 1 << 22
+
+# Number of decoded fortunes kept by a CompactStore or an MmapStore, the
+# most recently read ones.
+CACHE_SIZE = 1 << 12
+
+# An index file holds a header followed by the offsets of the fortunes,
+# as little-endian unsigned 64 bit integers. The header holds the device
+# and inode numbers of the fortune file, the size of the part of it that
+# was indexed, the number of fortunes in it, the checksum of the index
+# and the checksum of the whole indexed part.
+INDEX_SUFFIX = ".idx"
+INDEX_MAGIC = b"FIDX"
+INDEX_VERSION = 3
+INDEX_HEADER = struct.Struct("<4sIQQQQII")
+
+# The checksum of an index covers the last CHECK_SIZE bytes of the
+# indexed part of the file. The offsets of CHECK_COUNT fortunes, spread
+# over the file, are also checked to follow a separator.
+CHECK_SIZE = 1 << 16
+CHECK_COUNT = 64
+
+# Whether MmapStore checks the whole indexed part of the file by default.
+VERIFY_INDEX = os.environ.get("FORTUNE_VERIFY_INDEX", "0") != "0"
+
+
+def checksum(data, size, offsets):
+    """Return the checksum of an index.
+
+    It covers the end of the first size bytes of the fortune file, whose
+    contents are in data, and the offsets as they are written to the
+    index.
+
+    """
+
+    with memoryview(data) as view:
+        check = zlib.crc32(view[max(0, size - CHECK_SIZE):size])
+    return zlib.crc32(offsets, check)
+
+
+def parse(db_file):
+    """Return the list of the fortunes of a file."""
+
+    read_line = ""
+    fortunes = []
+    # Read database from file
+    with open(db_file) as f:
+        for line in f:
+            if(line == "%\n"):
+                fortunes.append(read_line)
+                read_line = ""
+            else:
+                read_line += line
+    return fortunes
+
+
+class ListStore(list):
+    """Keeps all the fortunes of a file in memory."""
+
+    def __init__(self, db_file):
+        list.__init__(self, parse(db_file))
+
+
+class _OffsetStore(object):
+    """Fortunes lying in a buffer, found with an array of their offsets.
+
+    Fortune i lies between offsets[i] and offsets[i + 1] in data, less
+    the separator. Fortunes are decoded as UTF-8, any invalid byte being
+    replaced rather than failing the read.
+
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = None
+        # Unsigned 64 bit offsets, so that files of any size fit.
+        self.offsets = array.array("Q", [0])
+        self._decoded = functools.lru_cache(CACHE_SIZE)(self._decode)
+
+    # Private methods
+
+    def _decode(self, i):
+        start = self.offsets[i]
+        end = self.offsets[i + 1] - len(SEPARATOR)
+        return self.data[start:end].decode("utf-8", "replace")
+
+    def _scan_slowly(self, data, start, end):
+        """Add the offsets of the fortunes of data[start:end], one by one.
+
+        Return the offset following the last complete fortune.
+
+        """
+
+        offsets = self.offsets
+        while start < end:
+            if data[start:start + len(SEPARATOR)] == SEPARATOR:
+                # An empty fortune.
+                stop = start
+            else:
+                stop = data.find(b"\n" + SEPARATOR, start, end)
+                if stop < 0:
+                    break
+                stop += 1
+            start = stop + len(SEPARATOR)
+            offsets.append(start)
+        return start
+
+    def _scan(self, data, start, end):
+        """Add the offsets of the fortunes of data[start:end].
+
+        The file is split into fortunes a chunk at a time, and their
+        offsets are summed up in C, which is many times faster than
+        looking for every separator in turn.
+
+        """
+
+        offsets = self.offsets
+        separator = b"\n" + SEPARATOR
+        while start < end:
+            # Fortunes start at the start of a line: the chunk starts with
+            # the newline before the fortune, so that the separator of an
+            # empty first fortune is found too.
+            stop = min(start + SCAN_SIZE, end)
+            chunk = data[start - 1:stop] if start else b"\n" + data[:stop]
+            fortunes = chunk.split(separator)
+            # The last fortune of the chunk may go on in the next one.
+            fortunes.pop()
+            if not fortunes:
+                # A fortune longer than a chunk, or an incomplete one.
+                stop = data.find(separator, start, end)
+                if stop < 0:
+                    break
+                start = stop + len(separator)
+                offsets.append(start)
+                continue
+            if separator + SEPARATOR in chunk:
+                # split misses the empty fortunes that follow another one.
+                start = self._scan_slowly(data, start, stop)
+                continue
+            # Every piece holds the newline before its fortune, less the
+            # newline and separator after it.
+            sizes = map(operator.add, map(len, fortunes),
+                        itertools.repeat(len(separator)))
+            offsets.extend(itertools.islice(
+                itertools.accumulate(itertools.chain([start - 1], sizes)),
+                1, None))
+            start = offsets[-1]
+
+    # Public methods
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("fortune index out of range")
+        return self._decoded(i)
+
+
+class CompactStore(_OffsetStore):
+    """Keeps the fortunes of a file in memory, in a single buffer.
+
+    The buffer holds the fortunes as they are in the file, separators
+    included. data and offsets, if given, are those of a snapshot.
+
+    """
+
+    def __init__(self, db_file, data=None, offsets=None):
+        _OffsetStore.__init__(self)
+        self.db_file = db_file
+        if data is None:
+            with open(db_file, "rb") as f:
+                data = bytearray(os.fstat(f.fileno()).st_size)
+                del data[f.readinto(data):]
+            self._scan(data, 0, len(data))
+            # An incomplete last fortune is not part of the database.
+            del data[self.offsets[-1]:]
+        else:
+            self.offsets = offsets
+        self.data = data
+
+    def append(self, fortune):
+        """Add a fortune."""
+
+        self.lock.acquire()
+        try:
+            self.data += (fortune + "\n").encode("utf-8") + SEPARATOR
+            self.offsets.append(len(self.data))
+        finally:
+            self.lock.release()
+
+    def snapshot(self):
+        """Return a copy of the store as it is now.
+
+        The copy is made of two buffers, the fortunes and their offsets,
+        so it is pickled, e.g. to be sent to another process, with two
+        copies rather than one object per fortune. Processes forked from
+        this one share the pages of a store as long as neither appends
+        to it, as reading it does not touch them.
+
+        """
+
+        self.lock.acquire()
+        try:
+            return CompactStore(self.db_file, bytearray(self.data),
+                                array.array("Q", self.offsets))
+        finally:
+            self.lock.release()
+
+    def __reduce__(self):
+        snapshot = self.snapshot()
+        return (CompactStore,
+                (snapshot.db_file, snapshot.data, snapshot.offsets))
+
+
+class MmapStore(_OffsetStore):
+    """Gives access to the fortunes of a memory mapped file.
+
+    Unless index is False, the offsets are read from and saved to the
+    index file of db_file when the store is opened. With verify, the
+    index is only used if the checksum of the whole part of the file it
+    covers matches, which takes reading all of it.
+
+    """
+
+    def __init__(self, db_file, index=True, verify=VERIFY_INDEX):
+        _OffsetStore.__init__(self)
+        self.db_file = db_file
+        self.index_file = db_file + INDEX_SUFFIX if index else None
+        self.verify = verify
+        self.size = 0
+        # The (device, inode) of the file.
+        self.file_id = None
+        # Bytes of the file covered by the index file, and their checksum.
+        self.indexed = 0
+        self.indexed_check = 0
+        self.refresh()
+        if self.index_file is not None and self.offsets[-1] != self.indexed:
+            self.save_index()
+
+    # Private methods
+
+    def _load_index(self, data, size):
+        """Take the offsets from the index file if it matches data."""
+
+        try:
+            with open(self.index_file, "rb") as f:
+                header = f.read(INDEX_HEADER.size)
+                body = f.read()
+        except OSError:
+            return
+        if len(header) != INDEX_HEADER.size:
+            return
+        (magic, version, dev, ino, indexed, count, check,
+         indexed_check) = INDEX_HEADER.unpack(header)
+        if (magic != INDEX_MAGIC or version != INDEX_VERSION or
+                (dev, ino) != self.file_id or indexed > size or
+                len(body) != (count + 1) * 8):
+            return
+        offsets = array.array("Q")
+        offsets.frombytes(body)
+        if sys.byteorder == "big":
+            offsets.byteswap()
+        if offsets[0] != 0 or offsets[-1] != indexed:
+            return
+        if checksum(data, indexed, body) != check:
+            return
+        for i in range(1, count + 1, max(1, count // CHECK_COUNT)):
+            if data[offsets[i] - len(SEPARATOR):offsets[i]] != SEPARATOR:
+                return
+        if self.verify:
+            with memoryview(data) as view:
+                if zlib.crc32(view[:indexed]) != indexed_check:
+                    return
+        self.offsets = offsets
+        self.indexed = indexed
+        self.indexed_check = indexed_check
+
+    # Public methods
+
+    def refresh(self):
+        """Take in the fortunes appended to the file since the last time."""
+
+        self.lock.acquire()
+        try:
+            size = os.path.getsize(self.db_file)
+            if size <= self.size:
+                return
+            with open(self.db_file, "rb") as f:
+                data = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ)
+                stat = os.fstat(f.fileno())
+            if self.data is None:
+                self.file_id = (stat.st_dev, stat.st_ino)
+                if self.index_file is not None:
+                    self._load_index(data, size)
+            # The previous map is left to the readers still using it.
+            self.data = data
+            self.size = size
+            self._scan(data, self.offsets[-1], size)
+        finally:
+            self.lock.release()
+
+    def save_index(self):
+        """Save the offsets of the fortunes to the index file.
+
+        The index file is replaced at once, so that the stores of other
+        processes never read half of it. Failing to write it, e.g. in a
+        read-only directory, is not an error: the file is then scanned
+        again the next time.
+
+        """
+
+        self.lock.acquire()
+        try:
+            offsets = array.array("Q", self.offsets)
+            data = self.data if self.data is not None else b""
+            start = self.indexed
+            indexed_check = self.indexed_check
+        finally:
+            self.lock.release()
+        indexed = offsets[-1]
+        # Only the part of the file indexed since is read.
+        with memoryview(data) as view:
+            indexed_check = zlib.crc32(view[start:indexed], indexed_check)
+        if sys.byteorder == "big":
+            offsets.byteswap()
+        dev, ino = self.file_id or (0, 0)
+        header = INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, dev, ino,
+                                   indexed, len(offsets) - 1,
+                                   checksum(data, indexed, offsets),
+                                   indexed_check)
+        temp_file = "{}.{}.tmp".format(self.index_file, os.getpid())
+        try:
+            with open(temp_file, "wb") as f:
+                f.write(header)
+                offsets.tofile(f)
+            os.replace(temp_file, self.index_file)
+        except OSError:
+            try:
+                os.remove(temp_file)
+            except OSError:
+                pass
+            return
+        self.lock.acquire()
+        try:
+            self.indexed = indexed
+            self.indexed_check = indexed_check
+        finally:
+            self.lock.release()
+
+    def append(self, fortune):
+        """Take in a fortune that has just been appended to the file."""
+
+        self.refresh()
+
+
+# Stores by name.
+STORES = {
+    "list": ListStore,
+    "compact": CompactStore,
+    "mmap": MmapStore
+}
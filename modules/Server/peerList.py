@@ -10,8 +10,17 @@
 """Package for handling a list of objects of the same type as a given one."""
 
 import threading
+from Common import breaker
 from Common import orb
 
+# Seconds after which a call to a peer is given up with DeadlineExceeded,
+# so that a hung peer cannot block the callers forever.
+TIMEOUT = 10.0
+
+# The methods of the peers that may be called again when a call could
+# not reach the peer, since calling them twice does no harm.
+RETRY = breaker.RetryPolicy(["check", "read", "register_peer"])
+
 
 class PeerList(object):
     """Class that builds a list of objects of the same type as this one."""
@@ -20,6 +29,27 @@ class PeerList(object):
         self.owner = owner
         self.lock = threading.Condition()
         self.peers = {}
+        # Ids of the peers whose circuit breaker is open. This has a
+        # lock of its own since the breakers report to us from the
+        # threads that read replies.
+        self.unavailable_lock = threading.Lock()
+        self.unavailable = set()
+
+    # Private methods
+
+    def _add_peer(self, pid, paddr):
+        stub = orb.Stub(paddr, TIMEOUT, RETRY)
+        stub.channel.breaker.add_listener(self.peer_state_changed)
+        self.peers[pid] = stub
+
+    def _remove_peer(self, pid):
+        stub = self.peers.pop(pid)
+        stub.channel.breaker.remove_listener(self.peer_state_changed)
+        self.unavailable_lock.acquire()
+        try:
+            self.unavailable.discard(pid)
+        finally:
+            self.unavailable_lock.release()
 
     # Public methods
 
@@ -46,18 +76,16 @@ class PeerList(object):
                 addr = peer[1]
                 # print("initializing peer ", peer_id)
                 if (not peer_id == self.owner.id):
-                    # self.peers[peer_id].register_peer(self.owner.id, self.owner.address)
-                    self.peers[peer_id] = orb.Stub(addr)
-
-                if (peer_id < self.owner.id):
-                    # Smart lock?
-                    # self.peers[peer_id] = orb.Stub(addr)
-                    self.peers[peer_id].register_peer(self.owner.id, self.owner.address)
-                
-                
-            #for pid in self.peers:
-            #self.peers[pid].register_peer(self.owner.id, self.owner.address);
-            
+                    self._add_peer(peer_id, addr)
+
+            # Register at all the peers with lower ids at once. This is
+            # not a one-way call, as the lock algorithm relies on the
+            # peers knowing us before we send them any other request.
+            lower = [pid for pid in self.peers if pid < self.owner.id]
+            results, errors = self.gather("register_peer", self.owner.id,
+                                          self.owner.address, pids=lower)
+            for error in errors.values():
+                raise error
         finally:
             self.lock.release()
         #for pid in self.peers:
@@ -69,8 +97,14 @@ class PeerList(object):
 
         self.lock.acquire()
         try:
+            # Nothing useful comes back, so do not wait for the replies.
             for pid in self.peers:
-                self.peers[pid].unregister_peer(self.owner.id)
+                try:
+                    self.peers[pid].unregister_peer.oneway(self.owner.id)
+                except Exception:
+                    print("Could not unregister from peer {}.".format(pid))
+            for pid in list(self.peers):
+                self._remove_peer(pid)
         finally:
             self.lock.release()
             
@@ -84,7 +118,7 @@ class PeerList(object):
         # this method in parallel.
         self.lock.acquire()
         try:
-            self.peers[pid] = orb.Stub(paddr)
+            self._add_peer(pid, paddr)
             # print("Peer {} has joined the system.".format(pid))
         finally:
             self.lock.release()
@@ -98,13 +132,70 @@ class PeerList(object):
         # print("Pid leaving: " + str(pid))
         try:
             if pid in self.peers:
-                del self.peers[pid]
+                self._remove_peer(pid)
                 print("Peer {} has left the system.".format(pid))
             else:
                 raise Exception("No peer with id: '{}'".format(pid))
         finally:
             self.lock.release()
 
+    def gather(self, method, *args, pids=None):
+        """Call a method on all the peers (or on the given ones) at once.
+
+        Return a (results, errors) pair of dictionaries indexed by the
+        peer ids, see orb.gather.
+
+        """
+
+        self.lock.acquire()
+        try:
+            if pids is None:
+                stubs = dict(self.peers)
+            else:
+                stubs = {pid: self.peers[pid] for pid in pids}
+        finally:
+            self.lock.release()
+        return orb.gather(stubs, method, *args)
+
+    def peer_state_changed(self, address, state):
+        """Called by the circuit breaker of a peer when its state changes."""
+
+        pids = [pid for pid, stub in list(self.peers.items())
+                if stub.address == address]
+        self.unavailable_lock.acquire()
+        try:
+            for pid in pids:
+                if state == breaker.OPEN:
+                    self.unavailable.add(pid)
+                else:
+                    self.unavailable.discard(pid)
+        finally:
+            self.unavailable_lock.release()
+        for pid in pids:
+            if state == breaker.OPEN:
+                print("Peer {} is not available.".format(pid))
+            else:
+                print("Peer {} is available again.".format(pid))
+
+    def is_available(self, pid):
+        """Return False if the peer looks dead."""
+
+        self.unavailable_lock.acquire()
+        try:
+            return pid not in self.unavailable
+        finally:
+            self.unavailable_lock.release()
+
+    def available(self):
+        """Return the ids of the peers that do not look dead."""
+
+        self.unavailable_lock.acquire()
+        try:
+            return [pid for pid in list(self.peers)
+                    if pid not in self.unavailable]
+        finally:
+            self.unavailable_lock.release()
+
     def display_peers(self):
         """Display all the peers in the list."""
 
@@ -114,7 +205,8 @@ class PeerList(object):
             print("List of peers of type '{}':".format(self.owner.type))
             for pid in pids:
                 addr = self.peers[pid].address
-                print("    id: {:>2}, address: {}".format(pid, addr))
+                state = "" if self.is_available(pid) else " (unavailable)"
+                print("    id: {:>2}, address: {}{}".format(pid, addr, state))
         finally:
             self.lock.release()
 
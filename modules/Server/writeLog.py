@@ -0,0 +1,201 @@
+# -----------------------------------------------------------------------------
+# Distributed Systems (TDDD25)
+# -----------------------------------------------------------------------------
+# Author: Sergiu Rafiliu (sergiu.rafiliu@liu.se)
+# Modified: 24 July 2013
+#
+# Copyright 2012 Linkoping University
+# -----------------------------------------------------------------------------
+
+"""Append-only log of a file, written with group commit.
+
+The records appended to a WriteLog are written by a single writer
+thread that keeps the file open. The records appended while it is busy
+are written together, with a single write, and a single fsync if any of
+them needs it, after which all their writers are woken at once. The
+more threads write at the same time, the more records share every
+system call.
+
+How durable a record must be before append returns is chosen with every
+call:
+
+--  NONE ::
+        Return at once. The record is written soon after, and is lost
+        if the process dies first. An error met writing it is raised by
+        the next call to append or close instead.
+--  OS ::
+        Return once the record is written to the file, so that other
+        processes see it. It is lost if the host crashes before the
+        system writes it to the disk.
+--  FSYNC ::
+        Return once the record is on the disk.
+
+"""
+
+import os
+import threading
+
+NONE = "none"
+OS = "os"
+FSYNC = "fsync"
+DURABILITIES = (NONE, OS, FSYNC)
+
+
+class _Batch(object):
+    """Records written together."""
+
+    def __init__(self):
+        self.data = []
+        self.records = []
+        self.sync = False
+        # Whether some of the records are not waited for.
+        self.detached = False
+        self.done = False
+        self.error = None
+
+
+class WriteLog(object):
+    """Appends records to a file from a single writer thread.
+
+    written, if given, is called by the writer thread with the records
+    of every batch once they are in the file, before their writers are
+    woken.
+
+    """
+
+    def __init__(self, path, written=None):
+        self.path = path
+        self.written = written
+        self.condition = threading.Condition()
+        self.batch = _Batch()
+        self.file = None
+        self.thread = None
+        self.closed = False
+        # The error met writing records nobody waited for, not raised yet.
+        self.error = None
+
+    # Private methods
+
+    def _write(self, batch):
+        """Write a batch to the file, and record how it went."""
+
+        try:
+            if self.file is None:
+                self.file = open(self.path, "ab")
+            self.file.write(b"".join(batch.data))
+            self.file.flush()
+            if batch.sync:
+                os.fsync(self.file.fileno())
+        except Exception as e:
+            batch.error = e
+            # Open the file anew for the next batch.
+            self._close_file()
+            return
+        try:
+            if self.written is not None:
+                self.written(batch.records)
+        except Exception as e:
+            batch.error = e
+
+    def _raise_error(self):
+        """Raise the error kept for the records nobody waited for."""
+
+        error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def _close_file(self):
+        if self.file is not None:
+            try:
+                self.file.close()
+            except Exception:
+                pass
+            self.file = None
+
+    def _run(self):
+        while True:
+            self.condition.acquire()
+            try:
+                while not self.batch.data and not self.closed:
+                    self.condition.wait()
+                if not self.batch.data:
+                    self._close_file()
+                    return
+                batch = self.batch
+                self.batch = _Batch()
+            finally:
+                self.condition.release()
+            self._write(batch)
+            self.condition.acquire()
+            try:
+                batch.done = True
+                if batch.error is not None and batch.detached:
+                    # Only the first error is kept, the later ones are
+                    # likely the same.
+                    self.error = self.error or batch.error
+                self.condition.notify_all()
+            finally:
+                self.condition.release()
+
+    # Public methods
+
+    def append(self, data, durability=OS, records=()):
+        """Append data to the file.
+
+        records are what is passed to written for it. Raise the error
+        met writing data, unless durability is NONE. If records appended
+        with NONE could not be written, raise that error instead, without
+        appending data.
+
+        """
+
+        if durability not in DURABILITIES:
+            raise ValueError("Unknown durability: {}".format(durability))
+        self.condition.acquire()
+        try:
+            if self.closed:
+                raise ValueError("The log is closed")
+            self._raise_error()
+            if self.thread is None:
+                # Started on the first write, so that processes forked
+                # before it have a writer thread of their own.
+                self.thread = threading.Thread(target=self._run)
+                self.thread.daemon = True
+                self.thread.start()
+            batch = self.batch
+            batch.data.append(data)
+            batch.records.extend(records)
+            batch.sync = batch.sync or durability == FSYNC
+            self.condition.notify_all()
+            if durability == NONE:
+                batch.detached = True
+                return
+            while not batch.done:
+                self.condition.wait()
+        finally:
+            self.condition.release()
+        if batch.error is not None:
+            raise batch.error
+
+    def close(self):
+        """Write the records appended so far and stop the writer thread.
+
+        Raise the error met writing the records appended with NONE, if
+        it has not been raised by append yet.
+
+        """
+
+        self.condition.acquire()
+        try:
+            self.closed = True
+            self.condition.notify_all()
+            thread = self.thread
+        finally:
+            self.condition.release()
+        if thread is not None:
+            thread.join()
+        self.condition.acquire()
+        try:
+            self._raise_error()
+        finally:
+            self.condition.release()
@@ -0,0 +1,46 @@
+# -----------------------------------------------------------------------------
+# Distributed Systems (TDDD25)
+# -----------------------------------------------------------------------------
+# Author: Sergiu Rafiliu (sergiu.rafiliu@liu.se)
+# Modified: 31 July 2013
+#
+# Copyright 2012 Linkoping University
+# -----------------------------------------------------------------------------
+
+"""Tests of the choice of the codec of a connection."""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "modules"))
+from Common import codec
+
+
+class CodecTest(unittest.TestCase):
+
+    def setUp(self):
+        self.trust_peers = codec.TRUST_PEERS
+        codec.TRUST_PEERS = False
+
+    def tearDown(self):
+        codec.TRUST_PEERS = self.trust_peers
+
+    def test_offer(self):
+        self.assertEqual(codec.offer(True)[0], codec.MARSHAL.name)
+        self.assertEqual(codec.offer(False), [codec.JSON.name])
+
+    def test_choose(self):
+        offered = [codec.MARSHAL.name, codec.JSON.name]
+        self.assertIs(codec.choose(offered, True), codec.MARSHAL)
+        self.assertIs(codec.choose(offered, False), codec.JSON)
+
+    def test_trust_peers(self):
+        codec.TRUST_PEERS = True
+        self.assertEqual(codec.offer(False)[0], codec.MARSHAL.name)
+        self.assertIs(codec.choose([codec.MARSHAL.name], False),
+                      codec.MARSHAL)
+
+
+if __name__ == "__main__":
+    unittest.main()
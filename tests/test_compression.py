@@ -0,0 +1,61 @@
+# -----------------------------------------------------------------------------
+# Distributed Systems (TDDD25)
+# -----------------------------------------------------------------------------
+# Author: Sergiu Rafiliu (sergiu.rafiliu@liu.se)
+# Modified: 31 July 2013
+#
+# Copyright 2012 Linkoping University
+# -----------------------------------------------------------------------------
+
+"""Tests of the compression of frames."""
+
+import os
+import sys
+import unittest
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "modules"))
+from Common import compression
+from Common import framing
+
+MAX_FRAME = 1 << 16
+
+
+class DecompressTest(unittest.TestCase):
+
+    def setUp(self):
+        self.max_frame = framing.MAX_FRAME
+        framing.MAX_FRAME = MAX_FRAME
+
+    def tearDown(self):
+        framing.MAX_FRAME = self.max_frame
+
+    def test_round_trip(self):
+        data = b"fortune " * (MAX_FRAME // 8)
+        for compressor in (compression.ZLIB, compression.ZLIB_DICT):
+            payload, flags = compression.pack(compressor, data)
+            self.assertEqual(flags, framing.COMPRESSED)
+            self.assertEqual(compression.unpack(compressor, payload, flags),
+                             data)
+
+    def test_bomb(self):
+        # Less than MAX_FRAME that decompresses to 64 times as much.
+        data = b"\0" * (MAX_FRAME << 6)
+        for compressor in (compression.ZLIB, compression.ZLIB_DICT):
+            payload = compressor.compress(data)
+            self.assertLess(len(payload), MAX_FRAME)
+            self.assertRaises(zlib.error, compression.unpack, compressor,
+                              payload, framing.COMPRESSED)
+
+    def test_truncated(self):
+        payload = compression.ZLIB.compress(b"fortune " * 1000)
+        self.assertRaises(zlib.error, compression.ZLIB.decompress,
+                          payload[:len(payload) // 2])
+
+    def test_large_header(self):
+        header = framing.pack_header(MAX_FRAME + 1)
+        self.assertRaises(ValueError, framing.unpack_header, header)
+
+
+if __name__ == "__main__":
+    unittest.main()
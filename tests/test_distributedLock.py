@@ -0,0 +1,114 @@
+# -----------------------------------------------------------------------------
+# Distributed Systems (TDDD25)
+# -----------------------------------------------------------------------------
+# Author: Sergiu Rafiliu (sergiu.rafiliu@liu.se)
+# Modified: 31 July 2013
+#
+# Copyright 2012 Linkoping University
+# -----------------------------------------------------------------------------
+
+"""Tests of the distributed lock, with peers living in this process."""
+
+import contextlib
+import io
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "modules"))
+from Server.Lock.distributedLock import DistributedLock
+
+WRITERS = 40
+
+
+class Owner(object):
+    def __init__(self, pid):
+        self.id = pid
+
+
+class PeerStub(object):
+    """Calls the lock of another peer directly, oneway in a thread."""
+
+    def __init__(self, lock):
+        self.lock = lock
+
+    @property
+    def obtain_token(self):
+        lock = self.lock
+
+        class Method(object):
+            def oneway(self, token):
+                threading.Thread(target=lock.obtain_token,
+                                 args=(dict(token),)).start()
+
+        return Method()
+
+
+class PeerList(object):
+    """The part of Server.peerList.PeerList the lock uses."""
+
+    def __init__(self):
+        self.lock = threading.Condition()
+        self.locks = {}
+        self.owner = None
+
+    def get_peers(self):
+        return dict((pid, PeerStub(lock)) for pid, lock in self.locks.items()
+                    if pid != self.owner.id)
+
+    def available(self):
+        return list(self.get_peers())
+
+    def is_available(self, pid):
+        return True
+
+    def peer(self, pid):
+        return PeerStub(self.locks[pid])
+
+    def gather(self, method, *args, pids=None):
+        results = {}
+        for pid in pids:
+            results[pid] = getattr(self.locks[pid], method)(*args)
+        return results, {}
+
+
+class DistributedLockTest(unittest.TestCase):
+
+    def test_many_writers(self):
+        locks = {}
+        for pid in (1, 2):
+            peer_list = PeerList()
+            peer_list.owner = Owner(pid)
+            peer_list.locks = locks
+            locks[pid] = DistributedLock(peer_list.owner, peer_list)
+        inside = []
+        overlaps = []
+
+        def write(lock):
+            lock.acquire()
+            try:
+                inside.append(lock)
+                if len(inside) > 1:
+                    overlaps.append(list(inside))
+                time.sleep(0.001)
+                inside.remove(lock)
+            finally:
+                lock.release()
+
+        with contextlib.redirect_stdout(io.StringIO()):
+            for lock in locks.values():
+                lock.initialize()
+            threads = [threading.Thread(target=write, args=(lock,))
+                       for lock in locks.values() for i in range(WRITERS)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(30)
+        self.assertFalse([thread for thread in threads if thread.is_alive()])
+        self.assertEqual(overlaps, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+# -----------------------------------------------------------------------------
+# Distributed Systems (TDDD25)
+# -----------------------------------------------------------------------------
+# Author: Sergiu Rafiliu (sergiu.rafiliu@liu.se)
+# Modified: 24 July 2013
+#
+# Copyright 2012 Linkoping University
+# -----------------------------------------------------------------------------
+
+"""Tests of the fortune stores and of the index files of MmapStore."""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "modules"))
+from Server import fortuneStore
+
+FORTUNES = 10000
+
+
+class MmapStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.db_file = os.path.join(self.dir, "fortunes.db")
+        with open(self.db_file, "w") as f:
+            for i in range(FORTUNES):
+                f.write("Fortune number {}.\n%\n".format(i))
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def assertMatchesFile(self, store):
+        self.assertEqual(store[:], fortuneStore.ListStore(self.db_file))
+
+    def test_index_is_used(self):
+        fortuneStore.MmapStore(self.db_file)
+        with open(self.db_file, "a") as f:
+            f.write("The last fortune.\n%\n")
+        store = fortuneStore.MmapStore(self.db_file)
+        self.assertEqual(len(store), FORTUNES + 1)
+        self.assertMatchesFile(store)
+
+    def join_fortunes(self, data, at):
+        """Return data with the fortunes around offset at joined."""
+
+        i = data.index(b"\n%\n", at) + 1
+        return data[:i] + b"-" + data[i + 1:]
+
+    def test_middle_of_file_edited(self):
+        fortuneStore.MmapStore(self.db_file)
+        # Join two fortunes in the middle, without changing the size of
+        # the file, the start or the end of it.
+        with open(self.db_file, "r+b") as f:
+            data = f.read()
+            f.seek(0)
+            f.write(self.join_fortunes(data, len(data) // 2))
+        store = fortuneStore.MmapStore(self.db_file, verify=True)
+        self.assertEqual(len(store), FORTUNES - 1)
+        self.assertMatchesFile(store)
+
+    def test_end_of_file_edited(self):
+        fortuneStore.MmapStore(self.db_file)
+        with open(self.db_file, "r+b") as f:
+            data = f.read()
+            f.seek(0)
+            f.write(self.join_fortunes(data, len(data) - 100))
+        store = fortuneStore.MmapStore(self.db_file)
+        self.assertEqual(len(store), FORTUNES - 1)
+        self.assertMatchesFile(store)
+
+    def test_file_replaced(self):
+        fortuneStore.MmapStore(self.db_file)
+        with open(self.db_file, "rb") as f:
+            data = f.read()
+        temp_file = self.db_file + ".tmp"
+        with open(temp_file, "wb") as f:
+            f.write(self.join_fortunes(data, len(data) // 2))
+        os.replace(temp_file, self.db_file)
+        store = fortuneStore.MmapStore(self.db_file)
+        self.assertEqual(len(store), FORTUNES - 1)
+        self.assertMatchesFile(store)
+
+    def test_verify_after_append(self):
+        fortuneStore.MmapStore(self.db_file)
+        with open(self.db_file, "a") as f:
+            f.write("The last fortune.\n%\n")
+        fortuneStore.MmapStore(self.db_file)
+        index_file = self.db_file + fortuneStore.INDEX_SUFFIX
+        saved = os.stat(index_file).st_ino
+        store = fortuneStore.MmapStore(self.db_file, verify=True)
+        # Saving the index again would have replaced the file.
+        self.assertEqual(os.stat(index_file).st_ino, saved)
+        self.assertEqual(len(store), FORTUNES + 1)
+
+    def test_index_edited(self):
+        fortuneStore.MmapStore(self.db_file)
+        index_file = self.db_file + fortuneStore.INDEX_SUFFIX
+        with open(index_file, "r+b") as f:
+            f.seek(os.path.getsize(index_file) // 2)
+            f.write(b"\xff")
+        self.assertMatchesFile(fortuneStore.MmapStore(self.db_file))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,236 @@
+# -----------------------------------------------------------------------------
+# Distributed Systems (TDDD25)
+# -----------------------------------------------------------------------------
+# Author: Sergiu Rafiliu (sergiu.rafiliu@liu.se)
+# Modified: 31 July 2013
+#
+# Copyright 2012 Linkoping University
+# -----------------------------------------------------------------------------
+
+"""Tests of the Object Request Broker."""
+
+import os
+import socket
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "modules"))
+from Common import asyncOrb
+from Common import breaker
+from Common import orb
+from Common import transport
+
+# More calls than workers, all waiting for a call made after them.
+WORKERS = 4
+CALLS = 40
+
+# Bytes of an argument that fills the buffers of a connection.
+LARGE = 1 << 26
+
+
+class Gate(object):
+    """Owner whose blocking method waits for the gate to be opened."""
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.opened = False
+        self.waiting = 0
+
+    @orb.blocking
+    def pass_through(self):
+        self.condition.acquire()
+        try:
+            self.waiting += 1
+            while not self.opened:
+                self.condition.wait()
+        finally:
+            self.condition.release()
+        return True
+
+    def open(self):
+        self.condition.acquire()
+        try:
+            self.opened = True
+            self.condition.notify_all()
+        finally:
+            self.condition.release()
+
+
+class BlockingTest(unittest.TestCase):
+    """Blocking calls must not take the workers their wakeup needs."""
+
+    def saturate(self, make_skeleton, loopback):
+        saved = transport.LOOPBACK
+        transport.LOOPBACK = loopback
+        try:
+            gate = Gate()
+            skeleton = make_skeleton(gate, ("127.0.0.1", 0), workers=WORKERS)
+            skeleton.start()
+        finally:
+            transport.LOOPBACK = saved
+        stub = orb.Stub(skeleton.address, timeout=10)
+        futures = [stub.pass_through.future() for i in range(CALLS)]
+        stub.open.oneway()
+        for future in futures:
+            self.assertTrue(future.result(10))
+
+    def test_threads(self):
+        self.saturate(orb.Skeleton, False)
+
+    def test_threads_loopback(self):
+        self.saturate(orb.Skeleton, True)
+
+    def test_asyncio(self):
+        self.saturate(asyncOrb.AsyncSkeleton, False)
+
+    def overload(self, make_skeleton):
+        gate = Gate()
+        skeleton = make_skeleton(gate, ("127.0.0.1", 0), workers=WORKERS,
+                                 queue_size=WORKERS, blocking_workers=WORKERS)
+        skeleton.start()
+        stub = orb.Stub(skeleton.address, timeout=10)
+        futures = [stub.pass_through.future() for i in range(CALLS)]
+        # The blocking calls have not taken the workers of the others.
+        stub.open()
+        rejected = 0
+        for future in futures:
+            try:
+                self.assertTrue(future.result(10))
+            except orb.OverloadError:
+                rejected += 1
+        self.assertGreater(rejected, 0)
+        self.assertEqual(skeleton.rejected(), rejected)
+
+    def test_threads_overload(self):
+        self.overload(orb.Skeleton)
+
+    def test_asyncio_overload(self):
+        self.overload(asyncOrb.AsyncSkeleton)
+
+    def test_lines(self):
+        gate = Gate()
+        skeleton = orb.Skeleton(gate, ("127.0.0.1", 0), workers=WORKERS)
+        skeleton.start()
+        clients = []
+        for i in range(WORKERS):
+            client = socket.create_connection(skeleton.address, 10)
+            client.sendall(b'{"method": "pass_through", "args": []}\n')
+            clients.append(client)
+        while gate.waiting < WORKERS:
+            time.sleep(0.01)
+        orb.Stub(skeleton.address, timeout=10).open()
+        for client in clients:
+            self.assertIn(b'"result": true', client.makefile("rb").readline())
+            client.close()
+
+
+class BreakerTest(unittest.TestCase):
+    """Only the calls that could not reach the peer open its breaker."""
+
+    def setUp(self):
+        saved = transport.LOOPBACK
+        transport.LOOPBACK = False
+        try:
+            self.gate = Gate()
+            self.skeleton = orb.Skeleton(self.gate, ("127.0.0.1", 0))
+            self.skeleton.start()
+        finally:
+            transport.LOOPBACK = saved
+
+    def tearDown(self):
+        self.gate.open()
+
+    def test_cancelled(self):
+        stub = orb.Stub(self.skeleton.address)
+        for i in range(breaker.FAILURES * 2):
+            stub.pass_through.future().cancel()
+        self.assertTrue(stub.channel.breaker.allow())
+
+    def test_expired(self):
+        stub = orb.Stub(self.skeleton.address, timeout=0.05)
+        for i in range(breaker.FAILURES):
+            self.assertRaises(orb.DeadlineExceeded, stub.pass_through)
+        self.assertFalse(stub.channel.breaker.allow())
+
+
+class Counter(object):
+    """Owner streaming numbers for as long as they are asked for."""
+
+    def count(self, n):
+        return iter(range(n))
+
+    def echo(self, value):
+        return value
+
+
+class StreamTest(unittest.TestCase):
+    """Streams waiting for their callers must not take every worker."""
+
+    def test_unconsumed_streams(self):
+        saved = transport.LOOPBACK
+        transport.LOOPBACK = False
+        try:
+            skeleton = orb.Skeleton(Counter(), ("127.0.0.1", 0), workers=2)
+            skeleton.start()
+        finally:
+            transport.LOOPBACK = saved
+        stub = orb.Stub(skeleton.address, timeout=3)
+        streams = [stub.count.stream(orb.STREAM_WINDOW * 4)
+                   for i in range(2)]
+        for stream in streams:
+            self.assertEqual(next(stream), 0)
+        self.assertEqual(stub.echo("fortune"), "fortune")
+        self.assertEqual(len(list(streams[0])), orb.STREAM_WINDOW * 4 - 1)
+
+
+class StalledServer(object):
+    """Server that answers the handshake, then reads nothing more."""
+
+    def __init__(self):
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(1)
+        self.address = self.listener.getsockname()
+        thread = threading.Thread(target=self.accept)
+        thread.daemon = True
+        thread.start()
+
+    def accept(self):
+        self.conn, _ = self.listener.accept()
+        self.conn.makefile("rb").readline()
+        self.conn.sendall(orb.handshake_message())
+
+
+class SendTimeoutTest(unittest.TestCase):
+    """Sending a request must not outlive the deadline of the call."""
+
+    def test_stalled_server(self):
+        server = StalledServer()
+        large = orb.Stub(server.address, timeout=2)
+        small = orb.Stub(server.address, timeout=0.5)
+        errors = []
+
+        def call_large():
+            try:
+                large.echo("x" * LARGE)
+            except Exception as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=call_large)
+        thread.start()
+        time.sleep(0.2)
+        # Waits for the large request, which holds up the connection.
+        started = time.perf_counter()
+        self.assertRaises(orb.DeadlineExceeded, small.echo, "x")
+        self.assertLess(time.perf_counter() - started, 1.5)
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        self.assertIsInstance(errors[0], orb.DeadlineExceeded)
+        # The rest of the large request cannot be sent any more.
+        self.assertTrue(large.channel.conn.closed)
+
+
+if __name__ == "__main__":
+    unittest.main()
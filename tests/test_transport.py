@@ -0,0 +1,70 @@
+# -----------------------------------------------------------------------------
+# Distributed Systems (TDDD25)
+# -----------------------------------------------------------------------------
+# Author: Sergiu Rafiliu (sergiu.rafiliu@liu.se)
+# Modified: 31 July 2013
+#
+# Copyright 2012 Linkoping University
+# -----------------------------------------------------------------------------
+
+"""Tests of the Unix domain sockets and of the peers trusted with them."""
+
+import os
+import shutil
+import socket
+import stat
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "modules"))
+from Common import transport
+
+
+@unittest.skipUnless(hasattr(socket, "AF_UNIX"), "No Unix domain sockets")
+class UnixTransportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.socket_dir = transport.SOCKET_DIR
+        transport.SOCKET_DIR = os.path.join(self.dir, "orb")
+        self.server = socket.socket()
+        self.server.bind(("127.0.0.1", 0))
+        self.address = self.server.getsockname()
+
+    def tearDown(self):
+        self.server.close()
+        transport.SOCKET_DIR = self.socket_dir
+        shutil.rmtree(self.dir)
+
+    def test_private_dir(self):
+        server = transport.UNIX.listen(self.address, 1)
+        self.assertIsNotNone(server)
+        mode = os.stat(transport.SOCKET_DIR).st_mode
+        self.assertEqual(stat.S_IMODE(mode), 0o700)
+        client = transport.UNIX.connect(self.address, 1)
+        self.assertIsNotNone(client)
+        self.assertEqual(transport.peer_uid(client), os.getuid())
+        client.close()
+        server.close()
+
+    def test_shared_dir(self):
+        os.mkdir(transport.SOCKET_DIR, 0o777)
+        os.chmod(transport.SOCKET_DIR, 0o777)
+        self.assertIsNone(transport.UNIX.listen(self.address, 1))
+        self.assertFalse(os.path.exists(transport.UNIX.path(self.address)))
+
+    def test_trusted_peer(self):
+        left, right = socket.socketpair(socket.AF_UNIX)
+        self.assertTrue(transport.is_trusted_peer(left))
+        left.close()
+        right.close()
+        self.server.listen(1)
+        client = socket.create_connection(self.address, 1)
+        # Even on this host, the user of a TCP peer cannot be told.
+        self.assertFalse(transport.is_trusted_peer(client))
+        client.close()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+# -----------------------------------------------------------------------------
+# Distributed Systems (TDDD25)
+# -----------------------------------------------------------------------------
+# Author: Sergiu Rafiliu (sergiu.rafiliu@liu.se)
+# Modified: 24 July 2013
+#
+# Copyright 2012 Linkoping University
+# -----------------------------------------------------------------------------
+
+"""Tests of the errors of the write log."""
+
+import os
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "modules"))
+from Server import writeLog
+
+
+class WriteLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        # The log cannot be written until the directory is made.
+        self.path = os.path.join(self.dir, "missing", "fortunes.db")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_error_raised_by_next_append(self):
+        log = writeLog.WriteLog(self.path)
+        log.append(b"lost\n", writeLog.NONE)
+        while log.error is None:
+            time.sleep(0.01)
+        os.mkdir(os.path.dirname(self.path))
+        self.assertRaises(OSError, log.append, b"refused\n")
+        log.append(b"written\n")
+        log.close()
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(), b"written\n")
+
+    def test_error_raised_by_close(self):
+        log = writeLog.WriteLog(self.path)
+        log.append(b"lost\n", writeLog.NONE)
+        self.assertRaises(OSError, log.close)
+
+
+if __name__ == "__main__":
+    unittest.main()